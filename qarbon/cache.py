@@ -0,0 +1,156 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+"""Persistent (on disk) caches."""
+
+__all__ = ["cache_directory", "DiskCache"]
+
+import os
+import time
+import pickle
+import sqlite3
+import threading
+
+
+def cache_directory():
+    """Returns the qarbon user cache directory (:data:`qarbon.config.CACHE_DIR`
+    or, if not set, $XDG_CACHE_HOME/qarbon). The directory is created if it
+    doesn't exist.
+
+    :return: the cache directory
+    :rtype: str"""
+    from qarbon import config
+    path = config.CACHE_DIR
+    if path is None:
+        base = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, config.NAMESPACE)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+class DiskCache(object):
+    """A persistent key/value store kept in a SQLite file. Keys are strings,
+    values are any picklable object. Each entry remembers when it was
+    stored. It is safe to use from several threads.
+
+    :param name: cache name. The cache is stored in a file called
+                 <name>.sqlite inside :func:`cache_directory`
+    :param filename: file name (overwrites the default location)"""
+
+    def __init__(self, name, filename=None):
+        if filename is None:
+            filename = os.path.join(cache_directory(), name + ".sqlite")
+        self.__name = name
+        self.__filename = filename
+        self.__lock = threading.Lock()
+        self.__db = db = sqlite3.connect(filename, check_same_thread=False)
+        # it is a cache: losing the last writes on a crash is acceptable
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute("CREATE TABLE IF NOT EXISTS cache "
+                   "(key TEXT PRIMARY KEY, value BLOB, stamp REAL)")
+        db.commit()
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    def get_item(self, key):
+        """Returns the value stored for the given key and the time when it
+        was stored.
+
+        :param key: the key
+        :type key: str
+        :return: a tuple (value, stamp) or None if the key doesn't exist
+        :rtype: tuple"""
+        with self.__lock:
+            row = self.__db.execute("SELECT value, stamp FROM cache "
+                                    "WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(bytes(row[0])), row[1]
+
+    def get(self, key, default=None, max_age=None):
+        """Returns the value stored for the given key.
+
+        :param key: the key
+        :type key: str
+        :param default: value returned if the key doesn't exist (or is too
+                        old)
+        :param max_age: maximum age (seconds) [default: None meaning any]
+        :type max_age: float
+        :return: the stored value or default"""
+        item = self.get_item(key)
+        if item is None:
+            return default
+        value, stamp = item
+        if max_age is not None and time.time() - stamp > max_age:
+            return default
+        return value
+
+    def set(self, key, value):
+        """Stores a value.
+
+        :param key: the key
+        :type key: str
+        :param value: a picklable object"""
+        self.update(((key, value),))
+
+    def update(self, items):
+        """Stores many values in a single transaction.
+
+        :param items: sequence of (key, value)"""
+        stamp = time.time()
+        rows = [(key, sqlite3.Binary(pickle.dumps(value, 2)), stamp)
+                for key, value in items]
+        with self.__lock:
+            self.__db.executemany("INSERT OR REPLACE INTO cache "
+                                  "VALUES (?, ?, ?)", rows)
+            self.__db.commit()
+
+    def delete(self, key):
+        """Removes a key (if it exists).
+
+        :param key: the key
+        :type key: str"""
+        with self.__lock:
+            self.__db.execute("DELETE FROM cache WHERE key=?", (key,))
+            self.__db.commit()
+
+    def keys(self):
+        """Returns all keys.
+
+        :return: list of keys
+        :rtype: list<str>"""
+        with self.__lock:
+            rows = self.__db.execute("SELECT key FROM cache").fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self):
+        """Removes all entries."""
+        with self.__lock:
+            self.__db.execute("DELETE FROM cache")
+            self.__db.commit()
+
+    def close(self):
+        """Closes the underlying file."""
+        with self.__lock:
+            self.__db.close()
+
+    def __contains__(self, key):
+        return self.get_item(key) is not None
+
+    def __repr__(self):
+        return "<DiskCache({0!r}, {1!r})>".format(self.__name, self.__filename)
@@ -86,7 +86,119 @@ DEFAULT_EXECUTOR = 'thread' # possible values 'thread', 'process', 'gevent'
 
 DEFAULT_MAX_WORKERS = 10
 
+#: maximum time (seconds) to wait for calls in flight at interpreter exit.
+#: Queued calls are cancelled. None means no automatic bounded shutdown
+DEFAULT_EXECUTOR_EXIT_TIMEOUT = 5.0
+
+#: default maximum number of calls per second for each rate limit key
+#: (ex: per device). None means no limit
+DEFAULT_RATE_LIMIT = None
+
+#: default maximum number of calls sent at once for each rate limit key.
+#: None means same as the rate limit
+DEFAULT_RATE_BURST = None
+
 EXECUTOR = DEFAULT_EXECUTOR
 
 MAX_WORKERS = DEFAULT_MAX_WORKERS
 
+EXECUTOR_EXIT_TIMEOUT = DEFAULT_EXECUTOR_EXIT_TIMEOUT
+
+RATE_LIMIT = DEFAULT_RATE_LIMIT
+
+RATE_BURST = DEFAULT_RATE_BURST
+
+# ----------------------------------------------------------------------------
+# Persistent cache
+# ----------------------------------------------------------------------------
+
+#: directory for persistent caches. None means $XDG_CACHE_HOME/qarbon
+#: (usually ~/.cache/qarbon)
+DEFAULT_CACHE_DIR = None
+
+CACHE_DIR = DEFAULT_CACHE_DIR
+
+# ----------------------------------------------------------------------------
+# Tango plugin
+# ----------------------------------------------------------------------------
+
+#: reads of the same device arriving within this time (seconds) are merged
+#: into a single read_attributes call. 0 disables read batching
+DEFAULT_TANGO_READ_BATCH_WINDOW = 0.005
+
+TANGO_READ_BATCH_WINDOW = DEFAULT_TANGO_READ_BATCH_WINDOW
+
+#: writes of the same device arriving within this time (seconds) are merged
+#: into a single write_attributes call. Only the last value written to each
+#: attribute is sent. 0 disables write batching
+DEFAULT_TANGO_WRITE_BATCH_WINDOW = 0.02
+
+TANGO_WRITE_BATCH_WINDOW = DEFAULT_TANGO_WRITE_BATCH_WINDOW
+
+#: keep the attribute configurations in a persistent cache so that panels
+#: can be built without waiting for the control system. Cached
+#: configurations are revalidated in the background
+DEFAULT_TANGO_CONFIG_CACHE = False
+
+TANGO_CONFIG_CACHE = DEFAULT_TANGO_CONFIG_CACHE
+
+#: polling period (seconds) used for attributes whose change events are not
+#: available. None disables the polling fallback
+DEFAULT_TANGO_POLL_PERIOD = 3.0
+
+TANGO_POLL_PERIOD = DEFAULT_TANGO_POLL_PERIOD
+
+#: default maximum rate (Hz) of value change notifications per attribute.
+#: Faster events are conflated (only the latest value is notified).
+#: None means no limit
+DEFAULT_TANGO_EVENT_MAX_RATE = None
+
+TANGO_EVENT_MAX_RATE = DEFAULT_TANGO_EVENT_MAX_RATE
+
+#: tango I/O mode: 'sync' (each request blocks an executor thread for the
+#: whole round trip) or 'asynch' (requests are sent with the tango
+#: asynchronous API and replies complete the futures from callbacks)
+DEFAULT_TANGO_IO_MODE = 'sync'
+
+TANGO_IO_MODE = DEFAULT_TANGO_IO_MODE
+
+#: delay (seconds) before retrying a failed device connection. The delay
+#: doubles on each consecutive failure up to TANGO_RECONNECT_MAX
+DEFAULT_TANGO_RECONNECT_MIN = 1.0
+
+DEFAULT_TANGO_RECONNECT_MAX = 60.0
+
+TANGO_RECONNECT_MIN = DEFAULT_TANGO_RECONNECT_MIN
+
+TANGO_RECONNECT_MAX = DEFAULT_TANGO_RECONNECT_MAX
+
+#: keep the last known value of each attribute in a persistent cache. At
+#: startup these values are served (flagged as stale) until live data
+#: arrives
+DEFAULT_TANGO_SNAPSHOT = False
+
+TANGO_SNAPSHOT = DEFAULT_TANGO_SNAPSHOT
+
+#: period (seconds) for saving the last known values (they are also saved
+#: on exit). None only saves on exit
+DEFAULT_TANGO_SNAPSHOT_PERIOD = 60.0
+
+TANGO_SNAPSHOT_PERIOD = DEFAULT_TANGO_SNAPSHOT_PERIOD
+
+#: time (seconds) during which the results of tango database queries (device
+#: and attribute lists used to expand wildcard names) are reused
+DEFAULT_TANGO_DB_CACHE_TTL = 300.0
+
+TANGO_DB_CACHE_TTL = DEFAULT_TANGO_DB_CACHE_TTL
+
+#: keep the tango database query cache in a persistent cache so that it
+#: survives application restarts (still subject to TANGO_DB_CACHE_TTL)
+DEFAULT_TANGO_DB_CACHE_PERSIST = False
+
+TANGO_DB_CACHE_PERSIST = DEFAULT_TANGO_DB_CACHE_PERSIST
+
+#: maximum time (seconds) to wait for the attribute lists of the devices
+#: matched by a wildcard name (devices answering later are left out)
+DEFAULT_TANGO_EXPAND_TIMEOUT = 3.0
+
+TANGO_EXPAND_TIMEOUT = DEFAULT_TANGO_EXPAND_TIMEOUT
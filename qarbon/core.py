@@ -12,13 +12,17 @@
 """Model core module."""
 
 __all__ = ["Quality", "Access", "DisplayLevel", "DataAccess", "DataType", 
-           "State", "AttributeConfig", "AttributeValue", "Manager",
-           "Factory", "Device", "Attribute", "Signal"]
+           "State", "AttributeConfig", "AttributeValue",
+           "LazyAttributeValue", "Manager",
+           "Factory", "Device", "Attribute", "Signal", "BoundSignal"]
 
 import abc
 import sys
 import weakref
+import datetime
+import threading
 
+from qarbon import log
 from qarbon.util import isString
 from qarbon.external.enum import Enum
 
@@ -180,6 +184,8 @@ class AttributeValue(object):
     * exc_info (tuple): a 3-tuple equivalent to sys.exc_info() if reading a
                         value resulted in an exception or None otherwise
     * error (bool): tells the read resulted in an error
+    * stale (bool): tells the value is a last known value (ex: from a
+                    previous session) waiting to be replaced by live data
     * config (AttributeConfig): config object from which this value was obtained
 
     Other configuration values can also be accessed:
@@ -219,6 +225,9 @@ class AttributeValue(object):
     #: bool
     error = False
 
+    #: bool
+    stale = False
+
     def __init__(self, r_value=None, r_timestamp=None, 
                  r_quality=Quality.Valid, w_value=None, exc_info=None,
                  config=None):
@@ -227,7 +236,8 @@ class AttributeValue(object):
             r_timestamp = datetime.datetime.now()
         self.r_timestamp = r_timestamp     
 
-        if r_value != AttributeValue.r_value:
+        # identity check: comparing a Quantity with None is very expensive
+        if r_value is not AttributeValue.r_value:
             self.r_value = r_value
             try:
                 r_ndim = self.r_value.ndim
@@ -290,6 +300,16 @@ warning_range = {0.warning_range}
     def value(self):
         return self.r_value
 
+    @property
+    def r_magnitude(self):
+        """the read value without units"""
+        return getattr(self.r_value, "magnitude", self.r_value)
+
+    @property
+    def w_magnitude(self):
+        """the write value without units"""
+        return getattr(self.w_value, "magnitude", self.w_value)
+
     @property
     def timestamp(self):
         return self.r_timestamp
@@ -312,6 +332,64 @@ warning_range = {0.warning_range}
         return self.r_ndim == 2
 
 
+class LazyAttributeValue(AttributeValue):
+    """An :class:`AttributeValue` for (potentially big) array data.
+
+    The read and write values are kept as given (ex: a numpy.ndarray, no
+    copy) and are available through :attr:`r_magnitude` and
+    :attr:`w_magnitude`. They are only converted (ex: into a Quantity with
+    the config units) the first time :attr:`r_value`/:attr:`w_value` are
+    accessed.
+
+    :param r_magnitude: read value
+    :param w_magnitude: write value
+    :param ndim: number of dimensions (default is r_magnitude.ndim)
+    :param convert: callable converting a magnitude into a value
+                    [default: None, meaning the magnitude is the value]
+
+    The remaining parameters are the same as :class:`AttributeValue`"""
+
+    def __init__(self, r_magnitude=None, r_timestamp=None,
+                 r_quality=Quality.Valid, w_magnitude=None, exc_info=None,
+                 config=None, ndim=None, convert=None):
+        AttributeValue.__init__(self, r_timestamp=r_timestamp,
+                                r_quality=r_quality, exc_info=exc_info,
+                                config=config)
+        if ndim is None:
+            ndim = getattr(r_magnitude, "ndim", 0)
+        self.r_ndim = ndim
+        self.__r_magnitude = r_magnitude
+        self.__w_magnitude = w_magnitude
+        self.__convert = convert
+        self.__r_value = None
+        self.__w_value = None
+
+    def __to_value(self, magnitude):
+        if magnitude is None or self.__convert is None:
+            return magnitude
+        return self.__convert(magnitude)
+
+    @property
+    def r_magnitude(self):
+        return self.__r_magnitude
+
+    @property
+    def w_magnitude(self):
+        return self.__w_magnitude
+
+    @property
+    def r_value(self):
+        if self.__r_value is None:
+            self.__r_value = self.__to_value(self.__r_magnitude)
+        return self.__r_value
+
+    @property
+    def w_value(self):
+        if self.__w_value is None:
+            self.__w_value = self.__to_value(self.__w_magnitude)
+        return self.__w_value
+
+
 class _Manager(object):
     
     def __init__(self):
@@ -400,15 +478,73 @@ class Attribute(object):
         return "{0}({1})".format(self.__class__.__name__, self.__name)
 
 
+class BoundSignal(object):
+    """A signal: a list of callables (slots) called on :meth:`emit`"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__slots = []
+
+    def connect(self, obj):
+        with self.__lock:
+            if obj not in self.__slots:
+                self.__slots.append(obj)
+
+    def disconnect(self, obj):
+        with self.__lock:
+            try:
+                self.__slots.remove(obj)
+            except ValueError:
+                pass
+
+    def receivers(self):
+        """Returns the number of connected slots"""
+        return len(self.__slots)
+
+    def emit(self, *args, **kwargs):
+        with self.__lock:
+            slots = list(self.__slots)
+        for slot in slots:
+            try:
+                slot(*args, **kwargs)
+            except Exception:
+                log.exception("Error calling %r", slot)
+
+
 class Signal(object):
+    """Signal declared in a class body. Each instance of the class gets its
+    own :class:`BoundSignal` (so all listeners of the same object share
+    it)::
+
+        class Attribute(object):
+            valueChanged = Signal()
+
+    A Signal used outside a class behaves like a :class:`BoundSignal`"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__bound = weakref.WeakKeyDictionary()
+        self.__signal = BoundSignal()
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        with self.__lock:
+            signal = self.__bound.get(obj)
+            if signal is None:
+                signal = self.__bound[obj] = BoundSignal()
+        return signal
 
     def connect(self, obj):
-        pass    
+        self.__signal.connect(obj)
 
     def disconnect(self, obj):
-        pass        
+        self.__signal.disconnect(obj)
+
+    def receivers(self):
+        return self.__signal.receivers()
 
     def emit(self, *args, **kwargs):
-        pass
+        self.__signal.emit(*args, **kwargs)
 
 
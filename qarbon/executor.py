@@ -11,11 +11,24 @@
 
 """Executor."""
 
-__all__ = ["Executor", "submit", "map", "shutdown"]
+__all__ = ["Executor", "submit", "submit_many", "map", "imap_unordered",
+           "submit_limited", "set_rate_limit", "TokenBucket", "in_flight",
+           "shutdown"]
 
 import sys
+import time
+import atexit
+import threading
+import itertools
+import functools
+import collections
 from concurrent import futures
 
+try:
+    from itertools import izip as _zip
+except ImportError:
+    _zip = zip
+
 
 class SerialExecutor(futures.Executor):
 
@@ -58,6 +71,17 @@ class GeventFuture(futures.Future):
         super(GeventFuture, self).__init__()
         #self._greenlet = gevent.Greenlet()
         self._greenlet = greenlet
+        # keep the Future state in sync with the greenlet so that
+        # add_done_callback(), futures.wait() and futures.as_completed()
+        # also work with this backend
+        self.set_running_or_notify_cancel()
+        greenlet.link(self.__on_ready)
+
+    def __on_ready(self, greenlet):
+        if greenlet.successful():
+            self.set_result(greenlet.value)
+        else:
+            self.set_exception(greenlet.exception)
 
     def result(self, timeout=None):
         import gevent
@@ -82,35 +106,457 @@ __EXECUTOR_MAP = dict(thread=futures.ThreadPoolExecutor,
                       gevent=GeventPoolExecutor,
                       serial=SerialExecutor)
 
+# python >= 3.9 joins the pool threads *before* running the atexit handlers.
+# Use the threading hook (when available) so the exit drain runs first
+_register_exit = getattr(threading, "_register_atexit", atexit.register)
+
+__EXIT_REGISTERED = False
 __EXECUTOR = None
 def Executor():
-    global __EXECUTOR
+    global __EXECUTOR, __EXIT_REGISTERED
     if __EXECUTOR is None:
         from qarbon import config
         klass = __EXECUTOR_MAP[config.EXECUTOR.lower()] 
         __EXECUTOR = klass(config.MAX_WORKERS)
+        if not __EXIT_REGISTERED:
+            try:
+                _register_exit(_exit_shutdown)
+            except RuntimeError:
+                # created during interpreter shutdown: too late to register
+                pass
+            __EXIT_REGISTERED = True
     return __EXECUTOR
 
 
+__IN_FLIGHT = {}
+__IN_FLIGHT_LOCK = threading.Lock()
+
+def _track(future, fn, args):
+    with __IN_FLIGHT_LOCK:
+        __IN_FLIGHT[future] = fn, args
+    future.add_done_callback(_untrack)
+
+
+def _untrack(future):
+    with __IN_FLIGHT_LOCK:
+        __IN_FLIGHT.pop(future, None)
+
+
+def _describe(fn, args):
+    if fn is _call_all:
+        return ", ".join(_describe(f, a) for f, a, _ in args[0])
+    fn = getattr(fn, "func", fn)  # functools.partial
+    name = getattr(fn, "__name__", None) or repr(fn)
+    args = ", ".join(repr(arg) for arg in args)
+    if len(args) > 80:
+        args = args[:77] + "..."
+    return "{0}({1})".format(name, args)
+
+
+def _submit(executor, fn, *args, **kwargs):
+    future = executor.submit(fn, *args, **kwargs)
+    _track(future, fn, args)
+    return future
+
+
+def in_flight():
+    """Returns a description of each call submitted to the executor which
+    has not finished yet (either queued or running).
+
+    :return: list of call descriptions
+    :rtype: list<str>"""
+    with __IN_FLIGHT_LOCK:
+        calls = list(__IN_FLIGHT.values())
+    return [_describe(fn, args) for fn, args in calls]
+
+
 def submit(fn, *args, **kwargs):
-    return Executor().submit(fn, *args, **kwargs)
+    return _submit(Executor(), fn, *args, **kwargs)
 submit.__doc__ = futures.Executor.submit.__doc__
 
+
+class TokenBucket(object):
+    """A token bucket. Tokens are added at *rate* tokens per second up to a
+    maximum of *burst* tokens.
+
+    :param rate: number of tokens per second
+    :param burst: maximum number of tokens [default: None meaning same as
+                  rate]"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = max(float(burst or rate), 1.0)
+        self.__tokens = self.burst
+        self.__stamp = time.time()
+
+    def __refill(self):
+        now = time.time()
+        self.__tokens = min(self.burst,
+                            self.__tokens + (now - self.__stamp) * self.rate)
+        self.__stamp = now
+
+    def consume(self):
+        """Tries to take a token from the bucket.
+
+        :return: True if a token was taken or False otherwise
+        :rtype: bool"""
+        self.__refill()
+        if self.__tokens >= 1.0:
+            self.__tokens -= 1.0
+            return True
+        return False
+
+    def delay(self):
+        """Returns the time until the next token is available.
+
+        :return: time (seconds)
+        :rtype: float"""
+        self.__refill()
+        return max(1.0 - self.__tokens, 0.0) / self.rate
+
+
+def _chain(future, inner_future):
+    if inner_future.cancelled():
+        future.set_exception(futures.CancelledError())
+        return
+    exc = inner_future.exception()
+    if exc is None:
+        future.set_result(inner_future.result())
+    else:
+        future.set_exception(exc)
+
+
+class _RateLimiter(object):
+    """Token bucket admission of calls. Calls exceeding the rate are queued
+    (in order) and submitted as soon as tokens become available"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.__lock = threading.Lock()
+        self.__queue = collections.deque()
+        self.__timer = None
+
+    def submit(self, fn, args, kwargs):
+        with self.__lock:
+            if not self.__queue and self.bucket.consume():
+                return submit(fn, *args, **kwargs)
+            future = futures.Future()
+            _track(future, fn, args)
+            self.__queue.append((future, fn, args, kwargs))
+            self.__schedule()
+        return future
+
+    def __schedule(self):
+        if self.__timer is None and self.__queue:
+            self.__timer = threading.Timer(self.bucket.delay(), self.__release)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def __release(self):
+        with self.__lock:
+            self.__timer = None
+            queue = self.__queue
+            while queue:
+                if queue[0][0].cancelled():
+                    queue.popleft()
+                    continue
+                if not self.bucket.consume():
+                    break
+                future, fn, args, kwargs = queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    inner_future = submit(fn, *args, **kwargs)
+                except Exception:
+                    future.set_exception(sys.exc_info()[1])
+                else:
+                    inner_future.add_done_callback(
+                        functools.partial(_chain, future))
+            self.__schedule()
+
+
+__RATE_LIMITERS = {}
+__RATE_LIMITERS_LOCK = threading.Lock()
+
+def set_rate_limit(key, rate, burst=None):
+    """Limits the rate at which calls submitted with :func:`submit_limited`
+    for the given key are sent to the executor.
+
+    :param key: any hashable (ex: a device name or a host name)
+    :param rate: maximum number of calls per second. None removes the limit
+                 (keys without limit fall back to
+                 :data:`qarbon.config.RATE_LIMIT`)
+    :param burst: maximum number of calls that may be sent at once
+                  [default: None meaning same as rate]"""
+    with __RATE_LIMITERS_LOCK:
+        if rate is None:
+            __RATE_LIMITERS.pop(key, None)
+        elif key in __RATE_LIMITERS:
+            __RATE_LIMITERS[key].bucket = TokenBucket(rate, burst)
+        else:
+            __RATE_LIMITERS[key] = _RateLimiter(TokenBucket(rate, burst))
+
+
+def _rate_limiter(key):
+    with __RATE_LIMITERS_LOCK:
+        limiter = __RATE_LIMITERS.get(key)
+        if limiter is None:
+            from qarbon import config
+            if config.RATE_LIMIT is None:
+                return None
+            bucket = TokenBucket(config.RATE_LIMIT, config.RATE_BURST)
+            limiter = __RATE_LIMITERS[key] = _RateLimiter(bucket)
+        return limiter
+
+
+def submit_limited(key, fn, *args, **kwargs):
+    """Same as :func:`submit` but subject to the rate limit of the given key
+    (see :func:`set_rate_limit`). Calls exceeding the rate are queued and
+    sent as soon as the rate allows it.
+
+    :param key: rate limit key (ex: a device name or a host name)
+    :param fn: the callable to execute
+    :return: a future representing the given call
+    :rtype: concurrent.futures.Future"""
+    limiter = _rate_limiter(key)
+    if limiter is None:
+        return submit(fn, *args, **kwargs)
+    return limiter.submit(fn, args, kwargs)
+
+
+def _normalize_call(call):
+    """Converts a call item (a callable or a tuple (fn[, args[, kwargs]]))
+    into a tuple (fn, args, kwargs)"""
+    if callable(call):
+        return call, (), {}
+    call = tuple(call)
+    args = call[1] if len(call) > 1 else ()
+    kwargs = call[2] if len(call) > 2 else {}
+    return call[0], args, kwargs
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _call_all(calls):
+    """Executes a chunk of calls. Returns a list of (exception, result)"""
+    results = []
+    for fn, args, kwargs in calls:
+        try:
+            results.append((None, fn(*args, **kwargs)))
+        except Exception:
+            results.append((sys.exc_info()[1], None))
+    return results
+
+
+def _call_chunk(fn, args_chunk):
+    """Executes fn for each set of arguments. Returns a list of results"""
+    return [fn(*args) for args in args_chunk]
+
+
+def _fan_out(fs, chunk_future):
+    if chunk_future.cancelled():
+        for f in fs:
+            f.cancel()
+        return
+    try:
+        results = chunk_future.result()
+    except Exception:
+        results = len(fs) * [(sys.exc_info()[1], None)]
+    for f, (exc, result) in _zip(fs, results):
+        if not f.set_running_or_notify_cancel():
+            continue
+        if exc is None:
+            f.set_result(result)
+        else:
+            f.set_exception(exc)
+
+
+def submit_many(calls, chunksize=1):
+    """Submits a batch of calls in a single operation.
+
+    :param calls: sequence of callables or tuples (fn[, args[, kwargs]])
+    :param chunksize: number of calls executed together as a single task.
+                      Values bigger than 1 reduce the per call overhead
+                      (specially with the process backend) at the cost of
+                      latency [default: 1]
+    :return: a list of futures (one for each call, in the same order)"""
+    executor = Executor()
+    calls = [_normalize_call(call) for call in calls]
+    if chunksize <= 1:
+        return [_submit(executor, fn, *args, **kwargs)
+                for fn, args, kwargs in calls]
+    result = []
+    for chunk in _chunks(calls, chunksize):
+        fs = [futures.Future() for _ in chunk]
+        chunk_future = _submit(executor, _call_all, chunk)
+        chunk_future.add_done_callback(functools.partial(_fan_out, fs))
+        result.extend(fs)
+    return result
+
+
 def wait(fs, timeout=None, return_when=futures.ALL_COMPLETED):
     return futures.wait(fs, timeout=timeout, return_when=return_when)
 wait.__doc__ = futures.wait.__doc__
 
+def _map_options(name, kwargs):
+    timeout = kwargs.pop('timeout', None)
+    chunksize = max(kwargs.pop('chunksize', 1), 1)
+    window = kwargs.pop('window', None)
+    if kwargs:
+        raise TypeError("{0}() got an unexpected keyword argument "
+                        "{1!r}".format(name, kwargs.popitem()[0]))
+    if window is None:
+        from qarbon import config
+        window = 2 * config.MAX_WORKERS
+    end_time = None if timeout is None else timeout + time.time()
+    return chunksize, max(window, 1), end_time
+
+
+def _map_tasks(fn, iterables, chunksize):
+    """Generator of submitted futures, one for each chunk of arguments"""
+    executor = Executor()
+    args = _zip(*iterables)
+    if chunksize == 1:
+        for a in args:
+            yield _submit(executor, fn, *a)
+    else:
+        for chunk in _chunks(args, chunksize):
+            yield _submit(executor, _call_chunk, fn, chunk)
+
+
+def _map_results(future, chunksize, end_time):
+    if end_time is None:
+        result = future.result()
+    else:
+        result = future.result(end_time - time.time())
+    if chunksize == 1:
+        return [result]
+    return result
+
+
+def _fill(add, tasks, count):
+    for task in itertools.islice(tasks, count):
+        add(task)
+
+
+def _iter_ordered(fs, tasks, window, chunksize, end_time):
+    try:
+        while fs:
+            results = _map_results(fs.popleft(), chunksize, end_time)
+            _fill(fs.append, tasks, window - len(fs))
+            for result in results:
+                yield result
+    finally:
+        for f in fs:
+            f.cancel()
+
+
+def _iter_unordered(fs, tasks, window, chunksize, end_time):
+    try:
+        while fs:
+            timeout = None if end_time is None else end_time - time.time()
+            done, fs = futures.wait(fs, timeout=timeout,
+                                    return_when=futures.FIRST_COMPLETED)
+            if not done:
+                raise futures.TimeoutError()
+            _fill(fs.add, tasks, window - len(fs))
+            for f in done:
+                for result in _map_results(f, chunksize, end_time):
+                    yield result
+    finally:
+        for f in fs:
+            f.cancel()
+
+
 def map(fn, *iterables, **kwargs):
-    return Executor().map(fn, *iterables, **kwargs)
-map.__doc__ = futures.Executor.map.__doc__
+    """Returns an iterator equivalent to map(fn, iter).
 
-def shutdown(wait=True):
+    Arguments are consumed lazily: at most *window* tasks are in flight at
+    any time so it is safe to use with very large (or infinite) iterables.
+
+    :param fn: a callable that will take as many arguments as there are
+               passed iterables
+    :param timeout: the maximum number of seconds to wait. If None, then
+                    there is no limit on the wait time
+    :param chunksize: number of items sent to a worker as a single task
+                      [default: 1]
+    :param window: maximum number of tasks in flight
+                   [default: 2 * config.MAX_WORKERS]
+    :return: an iterator equivalent to: map(func, *iterables) but the calls
+             may be evaluated out-of-order
+    :raises TimeoutError: if the entire result iterator could not be
+                          generated before the given timeout
+    :raises Exception: if fn(*args) raises for any values"""
+    chunksize, window, end_time = _map_options('map', kwargs)
+    tasks = _map_tasks(fn, iterables, chunksize)
+    fs = collections.deque()
+    _fill(fs.append, tasks, window)
+    return _iter_ordered(fs, tasks, window, chunksize, end_time)
+
+
+def imap_unordered(fn, *iterables, **kwargs):
+    """Same as :func:`map` except that results are yielded as soon as they
+    are ready (not necessarily in the order of the given arguments).
+
+    Accepts the same keyword arguments as :func:`map`"""
+    chunksize, window, end_time = _map_options('imap_unordered', kwargs)
+    tasks = _map_tasks(fn, iterables, chunksize)
+    fs = set()
+    _fill(fs.add, tasks, window)
+    return _iter_unordered(fs, tasks, window, chunksize, end_time)
+
+def shutdown(wait=True, timeout=None):
+    """Signals the executor that it should free any resources that it is
+    using when the currently pending futures are done executing.
+
+    If *timeout* is given, the shutdown is bounded: calls still queued are
+    cancelled, the running ones are given *timeout* seconds to finish and
+    the executor is then shut down without waiting for the remaining ones.
+
+    This is done automatically at interpreter exit with
+    :data:`qarbon.config.EXECUTOR_EXIT_TIMEOUT` as deadline.
+
+    :param wait: if True then shutdown will not return until all running
+                 futures have finished executing and the resources used by
+                 the executor have been reclaimed (ignored if a timeout is
+                 given)
+    :param timeout: drain deadline (seconds) [default: None, meaning no
+                    deadline]
+    :return: if a timeout is given, the description of the calls which
+             were still in flight when the deadline expired
+    :rtype: list<str>"""
     global __EXECUTOR
-    if __EXECUTOR is None:
+    executor = __EXECUTOR
+    if executor is None:
         return
-    result = __EXECUTOR.shutdown(wait=wait)
     __EXECUTOR = None
-    return result
-shutdown.__doc__ = futures.Executor.shutdown.__doc__
+    if timeout is None:
+        return executor.shutdown(wait=wait)
+
+    with __IN_FLIGHT_LOCK:
+        fs = list(__IN_FLIGHT)
+    for f in fs:
+        f.cancel()
+    not_done = futures.wait(fs, timeout=timeout).not_done
+    executor.shutdown(wait=False)
+    with __IN_FLIGHT_LOCK:
+        calls = [__IN_FLIGHT[f] for f in not_done if f in __IN_FLIGHT]
+    calls = [_describe(fn, args) for fn, args in calls]
+    if calls:
+        from qarbon import log
+        log.warning("executor shutdown: %d call(s) still in flight after "
+                    "%ss: %s", len(calls), timeout, "; ".join(calls))
+    return calls
 
 
+def _exit_shutdown():
+    from qarbon import config
+    if config.EXECUTOR_EXIT_TIMEOUT is not None:
+        shutdown(timeout=config.EXECUTOR_EXIT_TIMEOUT)
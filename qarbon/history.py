@@ -0,0 +1,140 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+"""Bounded value history."""
+
+__all__ = ["History"]
+
+import time
+import threading
+
+import numpy
+
+from qarbon.core import Quality
+
+
+def _to_timestamp(t):
+    """datetime or float -> seconds since epoch (float)"""
+    if t is None or isinstance(t, (int, float)):
+        return t
+    return time.mktime(t.timetuple()) + t.microsecond * 1E-6
+
+
+class History(object):
+    """A fixed capacity history of attribute values: timestamps (seconds
+    since epoch), magnitudes and quality codes (:class:`~qarbon.core.Quality`
+    values) kept in numpy arrays. Memory is allocated once; when full, the
+    oldest values are overwritten.
+
+    Every value is written twice (at i and i + capacity) so that the last
+    *capacity* values are always contiguous and can be returned as views
+    instead of copies. Views are only valid until the next values overwrite
+    them: copy them if they must be kept.
+
+    :param capacity: maximum number of values kept
+    :param shape: shape of each magnitude (ex: (1024,) for a spectrum)
+                  [default: () for scalars]
+    :param dtype: numpy dtype of the magnitudes [default: float64]"""
+
+    def __init__(self, capacity, shape=(), dtype=numpy.float64):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.__lock = threading.Lock()
+        self.__capacity = capacity
+        self.__count = 0
+        self.__times = numpy.zeros(2 * capacity, dtype=numpy.float64)
+        self.__magnitudes = numpy.zeros((2 * capacity,) + tuple(shape),
+                                        dtype=dtype)
+        self.__qualities = numpy.zeros(2 * capacity, dtype=numpy.uint8)
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+    @property
+    def shape(self):
+        return self.__magnitudes.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.__magnitudes.dtype
+
+    def __len__(self):
+        return min(self.__count, self.__capacity)
+
+    def append(self, attr_value):
+        """adds an :class:`~qarbon.core.AttributeValue`. Values with an error
+        are stored as NaN (0 for non float types) with Invalid quality"""
+        if attr_value.error:
+            magnitude, quality = None, Quality.Invalid
+        else:
+            magnitude, quality = attr_value.r_magnitude, attr_value.r_quality
+        self.add(attr_value.r_timestamp, magnitude, quality.value)
+
+    def add(self, timestamp, magnitude, quality=0):
+        """adds a value.
+
+        :param timestamp: datetime or seconds since epoch
+        :param magnitude: the value (None means no value: NaN/0)
+        :param quality: quality code [default: 0 (Valid)]"""
+        timestamp = _to_timestamp(timestamp)
+        if magnitude is None:
+            magnitude = numpy.nan if self.dtype.kind in "fc" else 0
+        with self.__lock:
+            i = self.__count % self.__capacity
+            j = i + self.__capacity
+            self.__times[i] = self.__times[j] = timestamp
+            self.__magnitudes[i] = self.__magnitudes[j] = magnitude
+            self.__qualities[i] = self.__qualities[j] = quality
+            self.__count += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__count = 0
+
+    def __range(self):
+        """returns the (start, stop) of the contiguous region holding the
+        values, oldest first"""
+        count, capacity = self.__count, self.__capacity
+        if count <= capacity:
+            return 0, count
+        start = count % capacity
+        return start, start + capacity
+
+    def last(self, n=None):
+        """returns views (times, magnitudes, qualities) of the last *n*
+        values (all if n is None), oldest first"""
+        with self.__lock:
+            start, stop = self.__range()
+        if n is not None:
+            start = max(start, stop - n)
+        return (self.__times[start:stop], self.__magnitudes[start:stop],
+                self.__qualities[start:stop])
+
+    def window(self, start=None, stop=None):
+        """returns views (times, magnitudes, qualities) of the values with
+        start <= timestamp < stop. Timestamps are expected to be appended in
+        increasing order.
+
+        :param start: datetime or seconds since epoch [default: oldest]
+        :param stop: datetime or seconds since epoch [default: newest]"""
+        with self.__lock:
+            first, last = self.__range()
+        times = self.__times[first:last]
+        i = 0 if start is None else \
+            times.searchsorted(_to_timestamp(start), side="left")
+        j = len(times) if stop is None else \
+            times.searchsorted(_to_timestamp(stop), side="left")
+        return (times[i:j], self.__magnitudes[first + i:first + j],
+                self.__qualities[first + i:first + j])
+
+    def __repr__(self):
+        return "<History({0}/{1}, shape={2})>".format(len(self), self.capacity,
+                                                      self.shape)
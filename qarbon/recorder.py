@@ -0,0 +1,502 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+"""Event recorder and replay.
+
+A :class:`Recorder` stores the values and configurations delivered by
+attributes (of any plugin) in a directory. A :class:`ReplayFactory` plays
+them back, at real-time or accelerated speed, with no control system::
+
+    from qarbon.recorder import Recorder, ReplayFactory
+
+    recorder = Recorder("/tmp/session")
+    recorder.add(factory.get_attribute("sys/tg_test/1/double_scalar"))
+    ...
+    recorder.close()
+
+    replay = ReplayFactory("/tmp/session", speed=10)
+    attr = replay.get_attribute("sys/tg_test/1/double_scalar")
+    attr.valueChanged.connect(on_change)
+    replay.start()
+
+The recording is columnar: each record field is kept in its own append only
+binary file (<field>.bin) which can be memory mapped with numpy. Value
+magnitudes are stored flattened (float64) in data.bin. Attribute names and
+configurations are kept in attributes.json."""
+
+__all__ = ["Recorder", "Recording", "ReplayFactory"]
+
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+from weakref import WeakValueDictionary
+from functools import partial
+from concurrent import futures
+
+import numpy
+
+from qarbon import log
+from qarbon.external.pint import Quantity
+from qarbon.core import Signal, Quality
+from qarbon.core import Device as _Device
+from qarbon.core import Attribute as _Attribute
+from qarbon.core import Factory as _Factory
+from qarbon.core import AttributeConfig, AttributeValue, LazyAttributeValue
+
+Dict = WeakValueDictionary
+
+#: record fields (file name, numpy dtype)
+COLUMNS = (("time", "<f8"), ("attr", "<u4"), ("kind", "u1"),
+           ("quality", "u1"), ("ndim", "u1"), ("offset", "<u8"),
+           ("dim0", "<u4"), ("dim1", "<u4"))
+
+DATA_DTYPE = "<f8"
+
+#: record kinds
+VALUE, CONFIG, ERROR = range(3)
+
+_CONFIG_FIELDS = ("name", "label", "description", "ndim", "format",
+                  "display_format")
+
+
+def _config_q2dict(attr_cfg):
+    result = dict((field, getattr(attr_cfg, field, None))
+                  for field in _CONFIG_FIELDS)
+    unit = getattr(attr_cfg, "unit", None)
+    if unit is not None:
+        unit = str(getattr(unit, "units", unit))
+    result["unit"] = unit
+    return result
+
+
+def _config_dict2q(cfg_dict):
+    result = AttributeConfig()
+    for field in _CONFIG_FIELDS:
+        setattr(result, field, cfg_dict.get(field))
+    unit = cfg_dict.get("unit")
+    if unit is not None:
+        result.unit = Quantity(1, units=unit).units
+    return result
+
+
+def _to_timestamp(t):
+    return time.mktime(t.timetuple()) + t.microsecond * 1E-6
+
+
+def _done(result):
+    future = futures.Future()
+    future.set_result(result)
+    return future
+
+
+def _failed(exc):
+    future = futures.Future()
+    future.set_exception(exc)
+    return future
+
+
+class Recorder(object):
+    """Records attribute values and configurations in a directory (created if
+    needed; an existing recording is appended to). Records are buffered
+    and written every *flush_size* records, on :meth:`flush` and on
+    :meth:`close`.
+
+    :param path: recording directory
+    :param flush_size: number of records buffered before writing"""
+
+    def __init__(self, path, flush_size=1024):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.__path = path
+        self.__flush_size = flush_size
+        self.__lock = threading.Lock()
+        self.__slots = {}
+        self.__meta = _load_meta(path)
+        self.__meta_dirty = False
+        self.__index = dict((name, i) for i, name
+                            in enumerate(self.__meta["names"]))
+        self.__last_config = {}
+        self.__files = dict((name, open(self.__filename(name), "ab"))
+                            for name, _ in COLUMNS)
+        self.__data_file = open(self.__filename("data"), "ab")
+        itemsize = numpy.dtype(DATA_DTYPE).itemsize
+        self.__offset = self.__data_file.tell() // itemsize
+        self.__records = []
+        self.__data = []
+
+    @property
+    def path(self):
+        return self.__path
+
+    def __filename(self, name):
+        return os.path.join(self.__path, name + ".bin")
+
+    def add(self, attribute):
+        """records every value notified by the attribute (through its
+        valueChanged signal)"""
+        name = "{0}/{1}".format(attribute.device.name, attribute.name)
+        slot = partial(self.__on_change, attribute, name)
+        with self.__lock:
+            if name in self.__slots:
+                return
+            self.__slots[name] = attribute, slot
+        attribute.valueChanged.connect(slot)
+
+    def remove(self, attribute):
+        """stops recording the given attribute"""
+        name = "{0}/{1}".format(attribute.device.name, attribute.name)
+        with self.__lock:
+            attribute, slot = self.__slots.pop(name, (None, None))
+        if slot is not None:
+            attribute.valueChanged.disconnect(slot)
+
+    def __on_change(self, attribute, name):
+        attribute.get_value().add_done_callback(partial(self.__on_value, name))
+
+    def __on_value(self, name, attr_value):
+        try:
+            self.record(name, attr_value.result())
+        except Exception:
+            log.debug("Failed to record %s", name, exc_info=1)
+
+    def __attr_index(self, name):
+        index = self.__index.get(name)
+        if index is None:
+            index = self.__index[name] = len(self.__meta["names"])
+            self.__meta["names"].append(name)
+            self.__meta["configs"].append([])
+        return index
+
+    def record_config(self, name, attr_cfg, timestamp=None):
+        """records a configuration of the given attribute"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.__lock:
+            self.__record_config(self.__attr_index(name), attr_cfg, timestamp)
+        self.__auto_flush()
+
+    def __record_config(self, index, attr_cfg, timestamp):
+        configs = self.__meta["configs"][index]
+        self.__last_config[index] = attr_cfg
+        configs.append(_config_q2dict(attr_cfg))
+        self.__records.append((timestamp, index, CONFIG, 0, 0,
+                               len(configs) - 1, 0, 0))
+        # written with the records (attributes.json is rewritten as a whole)
+        self.__meta_dirty = True
+
+    def record(self, name, attr_value):
+        """records an :class:`~qarbon.core.AttributeValue` of the given
+        attribute (full name). If its configuration changed it is recorded
+        first"""
+        timestamp = _to_timestamp(attr_value.r_timestamp)
+        with self.__lock:
+            index = self.__attr_index(name)
+            attr_cfg = attr_value.config
+            if attr_cfg is not None and \
+               self.__last_config.get(index) is not attr_cfg:
+                self.__record_config(index, attr_cfg, timestamp)
+            quality = attr_value.r_quality.value
+            if attr_value.error:
+                self.__records.append((timestamp, index, ERROR,
+                                       Quality.Invalid.value, 0,
+                                       self.__offset, 0, 0))
+            else:
+                try:
+                    magnitude = numpy.asarray(attr_value.r_magnitude,
+                                              dtype=DATA_DTYPE)
+                except (TypeError, ValueError):
+                    # non numerical values (ex: strings) are not recorded
+                    magnitude = numpy.asarray(numpy.nan, dtype=DATA_DTYPE)
+                shape = magnitude.shape + (0, 0)
+                self.__records.append((timestamp, index, VALUE, quality,
+                                       magnitude.ndim, self.__offset,
+                                       shape[0], shape[1]))
+                self.__data.append(magnitude.ravel())
+                self.__offset += magnitude.size
+        self.__auto_flush()
+
+    def __auto_flush(self):
+        if len(self.__records) >= self.__flush_size:
+            self.flush()
+
+    def __save_meta(self):
+        filename = os.path.join(self.__path, "attributes.json")
+        with open(filename + ".tmp", "w") as meta_file:
+            json.dump(self.__meta, meta_file)
+        os.rename(filename + ".tmp", filename)
+
+    def flush(self):
+        """writes the buffered records (and the attribute configurations
+        they refer to)"""
+        with self.__lock:
+            records, self.__records = self.__records, []
+            data, self.__data = self.__data, []
+            if not records:
+                return
+            if self.__meta_dirty:
+                self.__save_meta()
+                self.__meta_dirty = False
+            for data_item in data:
+                data_item.tofile(self.__data_file)
+            self.__data_file.flush()
+            columns = zip(*records)
+            for (name, dtype), column in zip(COLUMNS, columns):
+                record_file = self.__files[name]
+                numpy.asarray(column, dtype=dtype).tofile(record_file)
+                record_file.flush()
+
+    def close(self):
+        """stops recording and closes the files"""
+        for attribute, _ in list(self.__slots.values()):
+            self.remove(attribute)
+        self.flush()
+        with self.__lock:
+            for record_file in self.__files.values():
+                record_file.close()
+            self.__data_file.close()
+
+
+def _load_meta(path):
+    filename = os.path.join(path, "attributes.json")
+    if not os.path.exists(filename):
+        return dict(names=[], configs=[])
+    with open(filename) as meta_file:
+        return json.load(meta_file)
+
+
+def _map(filename, dtype):
+    """memory maps a (possibly empty) binary file"""
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(filename, dtype=dtype, mode="r")
+
+
+class Recording(object):
+    """Read only access to a recording made by :class:`Recorder`. Record
+    fields are available as memory mapped numpy arrays (ex:
+    recording.time, recording.attr)"""
+
+    def __init__(self, path):
+        self.__path = path
+        meta = _load_meta(path)
+        self.names = meta["names"]
+        self.__configs = [[_config_dict2q(cfg_dict) for cfg_dict in configs]
+                          for configs in meta["configs"]]
+        columns = [_map(os.path.join(path, name + ".bin"), dtype)
+                   for name, dtype in COLUMNS]
+        size = min(len(column) for column in columns)
+        for (name, _), column in zip(COLUMNS, columns):
+            setattr(self, name, column[:size])
+        self.data = _map(os.path.join(path, "data.bin"), DATA_DTYPE)
+
+    def __len__(self):
+        return len(self.time)
+
+    def magnitude(self, i):
+        """returns the magnitude of value record i (a view)"""
+        ndim, offset = self.ndim[i], int(self.offset[i])
+        shape = (int(self.dim0[i]), int(self.dim1[i]))[:ndim]
+        size = int(numpy.prod(shape)) if ndim else 1
+        result = self.data[offset:offset + size].reshape(shape)
+        return result if ndim else float(result)
+
+    def config(self, attr_index, config_index):
+        return self.__configs[attr_index][config_index]
+
+    def attribute_config(self, i):
+        """returns the AttributeConfig of config record i"""
+        return self.config(int(self.attr[i]), int(self.offset[i]))
+
+    def value(self, i, attr_cfg=None):
+        """builds the AttributeValue of value record i"""
+        timestamp = datetime.datetime.fromtimestamp(self.time[i])
+        quality = Quality(int(self.quality[i]))
+        if self.kind[i] == ERROR:
+            try:
+                raise ValueError("recorded error")
+            except ValueError:
+                return AttributeValue(r_timestamp=timestamp, r_quality=quality,
+                                      exc_info=sys.exc_info(), config=attr_cfg)
+        units = getattr(attr_cfg, "unit", None)
+        magnitude = self.magnitude(i)
+        if self.ndim[i]:
+            convert = lambda m: Quantity(m, units)
+            return LazyAttributeValue(r_magnitude=magnitude,
+                                      r_timestamp=timestamp, r_quality=quality,
+                                      config=attr_cfg, ndim=int(self.ndim[i]),
+                                      convert=convert)
+        return AttributeValue(r_value=Quantity(magnitude, units),
+                              r_timestamp=timestamp, r_quality=quality,
+                              config=attr_cfg)
+
+
+class Device(_Device):
+    """A device of a :class:`ReplayFactory`"""
+
+    def __init__(self, name):
+        _Device.__init__(self, name)
+        self.__attr_value_cache = {}
+        self.__attr_config_cache = {}
+
+    def _set_attribute_value_cache(self, attr_name, attr_value):
+        self.__attr_value_cache[attr_name.lower()] = _done(attr_value)
+
+    def _set_attribute_config_cache(self, attr_name, attr_cfg):
+        self.__attr_config_cache[attr_name.lower()] = _done(attr_cfg)
+
+    def _get_attribute_config(self, attr_name):
+        attr_cfg = self.__attr_config_cache.get(attr_name.lower())
+        return None if attr_cfg is None else attr_cfg.result()
+
+    def get_state(self):
+        return _done(None)
+
+    def read_attribute(self, attr_name):
+        """returns a Future of the last replayed AttributeValue"""
+        return self.get_attribute_value(attr_name)
+
+    def get_attribute_config(self, attr_name):
+        attr_cfg = self.__attr_config_cache.get(attr_name.lower())
+        if attr_cfg is None:
+            attr_cfg = _done(None)
+        return attr_cfg
+
+    def get_attribute_value(self, attr_name):
+        attr_value = self.__attr_value_cache.get(attr_name.lower())
+        if attr_value is None:
+            attr_value = _done(None)
+        return attr_value
+
+    def run_command(self, cmd_name, *args, **kwargs):
+        """returns a failed Future: commands cannot be replayed"""
+        return _failed(NotImplementedError("commands cannot be replayed"))
+
+
+class Attribute(_Attribute):
+    """An attribute of a :class:`ReplayFactory`"""
+
+    valueChanged = Signal()
+
+    def read(self):
+        return self.device.read_attribute(self.name)
+
+    def write(self, value):
+        """returns a failed Future: replayed attributes are read only"""
+        return _failed(NotImplementedError(
+            "replayed attributes are read only"))
+
+    def get_value(self):
+        return self.device.get_attribute_value(self.name)
+
+
+class ReplayFactory(_Factory):
+    """Factory which replays a recording made by :class:`Recorder`.
+
+    :param path: recording directory
+    :param speed: replay speed factor (2 means twice as fast as recorded).
+                  0 or None replays as fast as possible [default: 1]
+    :param loop: restart from the beginning at the end [default: False]"""
+
+    finished = Signal()
+
+    def __init__(self, path, speed=1.0, loop=False):
+        _Factory.__init__(self)
+        self.__lock = threading.Lock()
+        self.__recording = Recording(path)
+        self.__speed = speed
+        self.__loop = loop
+        self.__devices = {}
+        self.__attributes = Dict()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    @property
+    def recording(self):
+        return self.__recording
+
+    def get_device(self, name):
+        name_lower = name.lower()
+        with self.__lock:
+            device = self.__devices.get(name_lower)
+            if device is None:
+                device = self.__devices[name_lower] = Device(name)
+        return device
+
+    def get_attribute(self, name):
+        dev_name, attr_name = name.rsplit("/", 1)
+        device = self.get_device(dev_name)
+        name_lower = name.lower()
+        with self.__lock:
+            attribute = self.__attributes.get(name_lower)
+            if attribute is None:
+                attribute = Attribute(device, attr_name)
+                self.__attributes[name_lower] = attribute
+        return attribute
+
+    def start(self):
+        """starts replaying (in a background thread)"""
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name="qarbon.recorder.ReplayFactory")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+
+    def join(self, timeout=None):
+        """waits for the replay to finish"""
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def __run(self):
+        try:
+            while True:
+                self.__replay()
+                if not self.__loop or self.__stop.is_set():
+                    break
+        finally:
+            self.finished.emit()
+
+    def __replay(self):
+        recording = self.__recording
+        if not len(recording):
+            return
+        speed = self.__speed
+        t0, start = recording.time[0], time.time()
+        for i in range(len(recording)):
+            if self.__stop.is_set():
+                return
+            if speed:
+                wait = (recording.time[i] - t0) / speed - (time.time() - start)
+                if wait > 0 and self.__stop.wait(wait):
+                    return
+            try:
+                self.__replay_record(recording, i)
+            except Exception:
+                log.exception("Error replaying record %d", i)
+
+    def __replay_record(self, recording, i):
+        name = recording.names[int(recording.attr[i])]
+        dev_name, attr_name = name.rsplit("/", 1)
+        device = self.get_device(dev_name)
+        if recording.kind[i] == CONFIG:
+            attr_cfg = recording.attribute_config(i)
+            device._set_attribute_config_cache(attr_name, attr_cfg)
+        else:
+            attr_cfg = device._get_attribute_config(attr_name)
+            attr_value = recording.value(i, attr_cfg)
+            device._set_attribute_value_cache(attr_name, attr_value)
+        attribute = self.__attributes.get(name.lower())
+        if attribute is not None:
+            attribute.valueChanged.emit()
@@ -0,0 +1,841 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+"""Simulation plugin for qarbon.
+
+An in-process control system implementing the same interfaces as the tango
+plugin. Attributes produce scalar, spectrum or image data with configurable
+event rates, read latencies and fault injection. Useful to benchmark and
+test models and widgets without a control system::
+
+    from qarbon.simulation import Factory
+
+    factory = Factory()
+    factory.add_attribute("sim/detector/1/image", ndim=2, shape=(512, 512),
+                          rate=10)
+    image = factory.get_attribute("sim/detector/1/image")
+    image.valueChanged.connect(on_new_image)
+
+A :class:`TangoSimulator` simulates tango devices instead: it provides
+DeviceProxy objects (reads, writes, configs, commands and change events
+driven by the same specs) which the tango plugin uses once installed::
+
+    from qarbon.simulation import TangoSimulator
+
+    simulator = TangoSimulator(rate=10, latency=0.005)
+    simulator.add_attribute("sim/motor/1/position", unit="mm")
+    simulator.install()
+"""
+
+__all__ = ["SimulatedFault", "AttributeSpec", "Factory", "Device",
+           "Attribute", "DeviceProxy", "TangoSimulator"]
+
+import sys
+import math
+import time
+import heapq
+import random
+import datetime
+import threading
+import itertools
+from weakref import WeakValueDictionary
+from functools import partial
+from concurrent import futures
+
+from qarbon import log
+from qarbon.util import isString
+from qarbon.external.pint import Quantity
+from qarbon.executor import submit
+from qarbon.core import Signal, State, Access
+from qarbon.core import Device as _Device
+from qarbon.core import Attribute as _Attribute
+from qarbon.core import Factory as _Factory
+from qarbon.core import AttributeConfig, AttributeValue, LazyAttributeValue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import PyTango as Tango
+except ImportError:
+    Tango = None
+
+Dict = WeakValueDictionary
+
+
+class SimulatedFault(Exception):
+    """Exception raised by injected faults"""
+
+
+class AttributeSpec(object):
+    """Description of a simulated attribute.
+
+    :param name: attribute name
+    :param ndim: 0 (scalar), 1 (spectrum) or 2 (image) [default: 0]
+    :param shape: shape of spectrum/image data [default: (1024,) or
+                  (256, 256)]
+    :param unit: unit of the values [default: None]
+    :param rate: change event rate (Hz). 0 means no events [default: 0]
+    :param latency: delay (seconds) of each read [default: 0]
+    :param fault_rate: probability (0 to 1) that a read or an event fails
+                       [default: 0]
+    :param period: period (seconds) of the generated waveform [default: 10]
+    :param amplitude: amplitude of the generated waveform [default: 1]
+    :param noise: amplitude of the random noise added to values
+                  [default: 0.01]
+    :param writable: tells if the attribute can be written [default:
+                     False]"""
+
+    def __init__(self, name, ndim=0, shape=None, unit=None, rate=0.0,
+                 latency=0.0, fault_rate=0.0, period=10.0, amplitude=1.0,
+                 noise=0.01, writable=False):
+        if ndim not in (0, 1, 2):
+            raise ValueError("ndim must be 0, 1 or 2")
+        if ndim and numpy is None:
+            raise ValueError("simulated spectrum/image needs numpy")
+        if shape is None:
+            shape = ((), (1024,), (256, 256))[ndim]
+        self.name = name
+        self.ndim = ndim
+        self.shape = tuple(shape)
+        self.unit = unit
+        self.rate = rate
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.period = period
+        self.amplitude = amplitude
+        self.noise = noise
+        self.writable = writable
+
+    def config(self):
+        """builds the AttributeConfig of this attribute"""
+        result = AttributeConfig()
+        result.name = self.name
+        result.label = self.name
+        result.description = "simulated attribute"
+        result.ndim = self.ndim
+        result.access = Access.ReadWrite if self.writable else Access.Read
+        result.display_format = None
+        if self.unit is not None:
+            result.unit = Quantity(1, units=self.unit).units
+        return result
+
+    def generate(self, t):
+        """generates the value (magnitude) at time t"""
+        phase = 2 * math.pi * t / self.period
+        if self.ndim == 0:
+            noise = random.uniform(-self.noise, self.noise)
+            return self.amplitude * math.sin(phase) + noise
+        noise = numpy.random.uniform(-self.noise, self.noise, self.shape)
+        if self.ndim == 1:
+            x = numpy.linspace(0, 2 * math.pi, self.shape[0])
+            return self.amplitude * numpy.sin(x + phase) + noise
+        y, x = numpy.indices(self.shape)
+        cy, cx = self.shape[0] / 2.0, self.shape[1] / 2.0
+        cx += cx / 2 * math.cos(phase)
+        sigma2 = (min(self.shape) / 8.0) ** 2
+        spot = numpy.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * sigma2))
+        return self.amplitude * spot + noise
+
+    def fails(self):
+        """tells if the next operation should fail (fault injection)"""
+        return self.fault_rate > 0 and random.random() < self.fault_rate
+
+
+def _value(spec, attr_cfg, t=None, w_magnitude=None):
+    """builds an AttributeValue for the given spec at time t (with the given
+    write value magnitude)"""
+    if t is None:
+        t = time.time()
+    timestamp = datetime.datetime.fromtimestamp(t)
+    if spec.fails():
+        try:
+            raise SimulatedFault("simulated fault in {0}".format(spec.name))
+        except SimulatedFault:
+            return AttributeValue(r_timestamp=timestamp, config=attr_cfg,
+                                  exc_info=sys.exc_info())
+    magnitude = spec.generate(t)
+    units = attr_cfg.unit
+    if spec.ndim:
+        convert = lambda m: Quantity(m, units)
+        return LazyAttributeValue(r_magnitude=magnitude, r_timestamp=timestamp,
+                                  w_magnitude=w_magnitude, config=attr_cfg,
+                                  ndim=spec.ndim, convert=convert)
+    w_value = None if w_magnitude is None else Quantity(w_magnitude, units)
+    return AttributeValue(r_value=Quantity(magnitude, units), w_value=w_value,
+                          r_timestamp=timestamp, config=attr_cfg)
+
+
+def _done(result):
+    future = futures.Future()
+    future.set_result(result)
+    return future
+
+
+class _EventEngine(object):
+    """Single thread emitting the change events of all simulated attributes
+    (or event subscriptions) at their configured rates: registered objects
+    have a spec and a _fire() method. They are kept with weak references.
+    It also runs one-shot calls (:meth:`call_later`)"""
+
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__attributes = Dict()
+        self.__calls = {}  # negative id -> (callable, args)
+        self.__call_ids = itertools.count(-1, -1)
+        self.__schedule = []  # heap of (due time, id)
+        self.__thread = None
+
+    def __push(self, due, key):
+        heapq.heappush(self.__schedule, (due, key))
+        self.__cond.notify()
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run,
+                                             name="qarbon.simulation")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def register(self, attribute):
+        with self.__cond:
+            key = id(attribute)
+            self.__attributes[key] = attribute
+            self.__push(time.time(), key)
+
+    def call_later(self, delay, fn, *args):
+        """calls fn(*args) from the engine thread after delay seconds"""
+        with self.__cond:
+            key = next(self.__call_ids)
+            self.__calls[key] = fn, args
+            self.__push(time.time() + delay, key)
+
+    def __next_due(self):
+        """waits for the next due entry. Returns (callable, args)"""
+        with self.__cond:
+            while True:
+                if not self.__schedule:
+                    self.__cond.wait()
+                    continue
+                due, key = self.__schedule[0]
+                now = time.time()
+                if due > now:
+                    self.__cond.wait(due - now)
+                    continue
+                heapq.heappop(self.__schedule)
+                if key < 0:
+                    return self.__calls.pop(key)
+                attribute = self.__attributes.get(key)
+                if attribute is None or not attribute.spec.rate:
+                    continue
+                due = max(due + 1.0 / attribute.spec.rate, now)
+                heapq.heappush(self.__schedule, (due, key))
+                return attribute._fire, ()
+
+    def __run(self):
+        while True:
+            fn, args = self.__next_due()
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("Error running simulated event %s", fn)
+
+
+class Device(_Device):
+    """A simulated device"""
+
+    def __init__(self, name, factory):
+        _Device.__init__(self, name)
+        self.__factory = factory
+        self.__attr_value_cache = {}
+        self.__attr_value_stamp = {}
+        self.__attr_config_cache = {}
+        self.__w_magnitudes = {}
+
+    def get_spec(self, attr_name):
+        """returns the AttributeSpec of the given attribute"""
+        return self.__factory.get_spec(
+            "{0}/{1}".format(self.name, attr_name))
+
+    def __config(self, attr_name):
+        attr_name = attr_name.lower()
+        attr_cfg = self.__attr_config_cache.get(attr_name)
+        if attr_cfg is None:
+            attr_cfg = self.get_spec(attr_name).config()
+            self.__attr_config_cache[attr_name] = attr_cfg
+        return attr_cfg
+
+    def __read(self, attr_name):
+        spec = self.get_spec(attr_name)
+        if spec.latency:
+            time.sleep(spec.latency)
+        return self.__value(spec, attr_name)
+
+    def __value(self, spec, attr_name):
+        return _value(spec, self.__config(attr_name),
+                      w_magnitude=self.__w_magnitudes.get(attr_name.lower()))
+
+    def _set_attribute_value_cache(self, attr_name, value):
+        if not isinstance(value, futures.Future):
+            value = _done(value)
+        attr_name = attr_name.lower()
+        self.__attr_value_cache[attr_name] = value
+        self.__attr_value_stamp[attr_name] = time.time()
+
+    def get_state(self):
+        return _done(State.On)
+
+    def read_attribute(self, attr_name):
+        """returns a Future of AttributeValue"""
+        attr_value = submit(self.__read, attr_name)
+        self._set_attribute_value_cache(attr_name, attr_value)
+        return attr_value
+
+    def read_attributes(self, attr_names):
+        """returns dict<attr name, Future of AttributeValue>"""
+        return dict((attr_name, self.read_attribute(attr_name))
+                    for attr_name in attr_names)
+
+    def get_attribute_config(self, attr_name):
+        """returns a Future of AttributeConfig"""
+        return _done(self.__config(attr_name))
+
+    def get_attribute_value(self, attr_name, max_age=None):
+        """returns a Future of the cached AttributeValue.
+
+        :param max_age: maximum age (seconds) of the cached value. An older
+                        value is read again [default: None, meaning any
+                        age]"""
+        attr_name = attr_name.lower()
+        attr_value = self.__attr_value_cache.get(attr_name)
+        if attr_value is not None and max_age is not None and \
+           attr_value.done():
+            age = time.time() - self.__attr_value_stamp.get(attr_name, 0.0)
+            if age > max_age:
+                attr_value = None
+        if attr_value is None:
+            attr_value = self.read_attribute(attr_name)
+        return attr_value
+
+    def write_attribute(self, attr_name, value):
+        """writes an attribute: the value (converted to the attribute unit
+        if it is a Quantity) becomes the write value of the next values.
+
+        :return: a done Future (failed if the attribute is not writable)"""
+        spec = self.get_spec(attr_name)
+        result = futures.Future()
+        if not spec.writable:
+            result.set_exception(ValueError("{0}/{1} is not writable".format(
+                self.name, attr_name)))
+            return result
+        if isinstance(value, Quantity):
+            unit = self.__config(attr_name).unit
+            if unit is not None:
+                value = value.to(unit)
+            value = value.magnitude
+        self.__w_magnitudes[attr_name.lower()] = value
+        result.set_result(None)
+        return result
+
+    def run_command(self, cmd_name, *args, **kwargs):
+        """simulated commands return their arguments"""
+        return _done(args)
+
+    def _fire(self, attr_name):
+        """generates a new value of the attribute (as for a change event)"""
+        attr_value = self.__value(self.get_spec(attr_name), attr_name)
+        self._set_attribute_value_cache(attr_name, attr_value)
+
+
+class Attribute(_Attribute):
+    """A simulated attribute"""
+
+    valueChanged = Signal()
+
+    @property
+    def spec(self):
+        return self.device.get_spec(self.name)
+
+    def _fire(self):
+        self.device._fire(self.name)
+        self.valueChanged.emit()
+
+    def read(self):
+        return self.device.read_attribute(self.name)
+
+    def write(self, value):
+        """writes the attribute (see :meth:`Device.write_attribute`)"""
+        return self.device.write_attribute(self.name, value)
+
+    def get_value(self, max_age=None):
+        return self.device.get_attribute_value(self.name, max_age=max_age)
+
+
+class _SpecRegistry(object):
+    """Attribute specs of a simulated control system. Unknown attributes
+    get a default :class:`AttributeSpec` built from *default_spec*"""
+
+    def __init__(self, **default_spec):
+        self.__lock = threading.Lock()
+        self.__specs = {}
+        self.__default_spec = default_spec
+
+    def add_attribute(self, name, **kwargs):
+        """describes a simulated attribute.
+
+        :param name: full attribute name (device name/attribute name)
+        :param kwargs: see :class:`AttributeSpec`
+        :return: the AttributeSpec"""
+        attr_name = name.rsplit("/", 1)[1]
+        spec = AttributeSpec(attr_name, **kwargs)
+        with self.__lock:
+            self.__specs[name.lower()] = spec
+        return spec
+
+    def get_spec(self, name):
+        """returns the AttributeSpec of the given full attribute name"""
+        name_lower = name.lower()
+        spec = self.__specs.get(name_lower)
+        if spec is None:
+            with self.__lock:
+                spec = self.__specs.get(name_lower)
+                if spec is None:
+                    attr_name = name.rsplit("/", 1)[1]
+                    spec = AttributeSpec(attr_name, **self.__default_spec)
+                    self.__specs[name_lower] = spec
+        return spec
+
+    def get_attribute_list(self, dev_name):
+        """returns the names of the attributes described for a device"""
+        prefix = dev_name.lower() + "/"
+        with self.__lock:
+            return [spec.name for name, spec in self.__specs.items()
+                    if name.startswith(prefix)]
+
+
+class Factory(_Factory, _SpecRegistry):
+    """Factory of simulated devices and attributes.
+
+    Attributes are described with :meth:`add_attribute`. Unknown attributes
+    get a default :class:`AttributeSpec` built from the keyword arguments
+    given here"""
+
+    def __init__(self, **default_spec):
+        _Factory.__init__(self)
+        _SpecRegistry.__init__(self, **default_spec)
+        self.__lock = threading.Lock()
+        self.__devices = Dict()
+        self.__attributes = Dict()
+        self.__engine = _EventEngine()
+
+    def get_device(self, name):
+        name_lower = name.lower()
+        with self.__lock:
+            device = self.__devices.get(name_lower)
+            if device is None:
+                device = self.__devices[name_lower] = Device(name, self)
+        return device
+
+    def get_attribute(self, name):
+        dev_name, attr_name = name.rsplit("/", 1)
+        device = self.get_device(dev_name)
+        name_lower = name.lower()
+        with self.__lock:
+            attribute = self.__attributes.get(name_lower)
+            if attribute is None:
+                attribute = Attribute(device, attr_name)
+                self.__attributes[name_lower] = attribute
+                if attribute.spec.rate:
+                    self.__engine.register(attribute)
+        return attribute
+
+
+class _TangoInfo(object):
+    """Minimal stand-in for tango info and event objects"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _throw(reason, desc, origin):
+    Tango.Except.throw_exception(reason, desc, origin)
+
+
+def _errors(reason, desc, origin):
+    """returns the errors (DevError sequence) of a DevFailed"""
+    try:
+        _throw(reason, desc, origin)
+    except Tango.DevFailed:
+        return sys.exc_info()[1].args
+
+
+_DATA_FORMATS = "SCALAR", "SPECTRUM", "IMAGE"
+
+
+def _tango_config(spec):
+    """builds an object equivalent to a tango attribute config (as far as
+    the tango plugin is concerned) for the given spec"""
+    not_spec = Tango.constants.AlrmValueNotSpec
+    data_format = getattr(Tango.AttrDataFormat, _DATA_FORMATS[spec.ndim])
+    if spec.writable:
+        writable = Tango.AttrWriteType.READ_WRITE
+    else:
+        writable = Tango.AttrWriteType.READ
+    unit = Tango.constants.UnitNotSpec if spec.unit is None else spec.unit
+    return _TangoInfo(
+        name=spec.name, label=spec.name, description="simulated attribute",
+        data_type=Tango.CmdArgType.DevDouble, data_format=data_format,
+        disp_level=Tango.DispLevel.OPERATOR, format="%6.2f",
+        writable=writable, unit=unit,
+        display_unit=Tango.constants.DispUnitNotSpec,
+        standard_unit=Tango.constants.StdUnitNotSpec,
+        min_value=not_spec, max_value=not_spec, min_alarm=not_spec,
+        max_alarm=not_spec,
+        alarms=_TangoInfo(min_warning=not_spec, max_warning=not_spec))
+
+
+class _Subscription(object):
+    """Change event subscription of a simulated DeviceProxy (registered in
+    the event engine while the subscription is alive)"""
+
+    def __init__(self, device_proxy, attr_name, callback):
+        self.device_proxy = device_proxy
+        self.attr_name = attr_name
+        self.push = getattr(callback, "push_event", callback)
+
+    @property
+    def spec(self):
+        return self.device_proxy._get_spec(self.attr_name)
+
+    def _fire(self):
+        self.push(self.device_proxy._change_event(self.attr_name))
+
+
+class DeviceProxy(object):
+    """A simulated tango DeviceProxy. It implements the part of the PyTango
+    API used by the tango plugin: reads (with the spec latency and fault
+    injection), asynchronous reads and writes, attribute configs, commands
+    and change events emitted at the spec rates.
+
+    Injected faults raise (or are reported as) DevFailed"""
+
+    def __init__(self, name, simulator):
+        self.__name = name
+        self.__simulator = simulator
+        self.__lock = threading.Lock()
+        self.__ids = itertools.count(1)
+        self.__subscriptions = {}  # event id -> _Subscription or None
+        self.__requests = {}  # request id -> (due time, request)
+        self.__w_values = {}
+
+    def dev_name(self):
+        return self.__name
+
+    def _get_spec(self, attr_name):
+        return self.__simulator.get_spec(
+            "{0}/{1}".format(self.__name, attr_name))
+
+    def __value(self, attr_name, origin):
+        """builds a DeviceAttribute-like value (raises DevFailed on an
+        injected fault)"""
+        spec = self._get_spec(attr_name)
+        if spec.fails():
+            _throw("SimulatedFault",
+                   "simulated fault in {0}/{1}".format(self.__name,
+                                                       attr_name), origin)
+        t = time.time()
+        return _TangoInfo(name=attr_name, value=spec.generate(t),
+                          w_value=self.__w_values.get(attr_name.lower()),
+                          type=Tango.CmdArgType.DevDouble,
+                          quality=Tango.AttrQuality.ATTR_VALID,
+                          time=Tango.TimeVal.fromtimestamp(t),
+                          has_failed=False, is_empty=False)
+
+    def __latency(self, attr_names):
+        return max([self._get_spec(attr_name).latency
+                    for attr_name in attr_names] or [0.0])
+
+    def __request(self, request, attr_names):
+        """registers an asynchronous request (polling model)"""
+        req_id = next(self.__ids)
+        due = time.time() + self.__latency(attr_names)
+        with self.__lock:
+            self.__requests[req_id] = due, request
+        return req_id
+
+    def __reply(self, req_id):
+        with self.__lock:
+            due, request = self.__requests.pop(req_id)
+        wait = due - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        return request()
+
+    def __push_request(self, callback, cb_name, attr_names, request):
+        """registers an asynchronous request (push model): as in tango, the
+        reply is pushed to the callback from another thread (the engine
+        one), once the latency elapsed"""
+        self.__simulator._call_later(self.__latency(attr_names),
+                                     self.__push_reply, callback, cb_name,
+                                     attr_names, request)
+
+    def __push_reply(self, callback, cb_name, attr_names, request):
+        """runs an asynchronous request (push model) and calls the callback
+        with its reply"""
+        try:
+            argout, err, errors = request(), False, None
+        except Tango.DevFailed:
+            argout, err, errors = None, True, sys.exc_info()[1].args
+        getattr(callback, cb_name)(_TangoInfo(
+            device=self, attr_names=attr_names, argout=argout, err=err,
+            errors=errors))
+
+    def get_attribute_list(self):
+        return self.__simulator.get_attribute_list(self.__name)
+
+    def read_attribute(self, attr_name, extract_as=None):
+        time.sleep(self.__latency((attr_name,)))
+        return self.__value(attr_name, "DeviceProxy.read_attribute")
+
+    def __failed_value(self, attr_name, errors):
+        """builds a failed DeviceAttribute-like value: read_attributes
+        reports the errors of single attributes in their values"""
+        return _TangoInfo(name=attr_name, value=None, w_value=None,
+                          type=Tango.CmdArgType.DevDouble,
+                          quality=Tango.AttrQuality.ATTR_INVALID,
+                          time=Tango.TimeVal.fromtimestamp(time.time()),
+                          has_failed=True, is_empty=True,
+                          get_err_stack=lambda: errors)
+
+    def __read_attributes(self, attr_names):
+        result = []
+        for attr_name in attr_names:
+            try:
+                result.append(self.__value(attr_name,
+                                           "DeviceProxy.read_attributes"))
+            except Tango.DevFailed:
+                errors = sys.exc_info()[1].args
+                result.append(self.__failed_value(attr_name, errors))
+        return result
+
+    def read_attributes(self, attr_names, extract_as=None):
+        """reads several attributes. As in tango, an injected fault doesn't
+        fail the call: the value of the attribute has_failed"""
+        attr_names = list(attr_names)
+        time.sleep(self.__latency(attr_names))
+        return self.__read_attributes(attr_names)
+
+    def read_attributes_asynch(self, attr_names, callback=None,
+                               extract_as=None):
+        attr_names = list(attr_names)
+        request = partial(self.__read_attributes, attr_names)
+        if callback is None:
+            return self.__request(request, attr_names)
+        self.__push_request(callback, "attr_read", attr_names, request)
+
+    def read_attributes_reply(self, req_id, timeout=0, extract_as=None):
+        return self.__reply(req_id)
+
+    def get_attribute_config_ex(self, attr_names):
+        if isString(attr_names):
+            attr_names = (attr_names,)
+        return [_tango_config(self._get_spec(attr_name))
+                for attr_name in attr_names]
+
+    def attribute_list_query_ex(self):
+        return self.get_attribute_config_ex(self.get_attribute_list())
+
+    def __write_attributes(self, attr_values):
+        for attr_name, _ in attr_values:
+            spec = self._get_spec(attr_name)
+            if not spec.writable:
+                _throw("API_AttrNotWritable",
+                       "{0}/{1} is not writable".format(self.__name,
+                                                        attr_name),
+                       "DeviceProxy.write_attributes")
+            if spec.fails():
+                _throw("SimulatedFault",
+                       "simulated fault writing {0}/{1}".format(self.__name,
+                                                                attr_name),
+                       "DeviceProxy.write_attributes")
+        for attr_name, value in attr_values:
+            self.__w_values[attr_name.lower()] = value
+
+    def write_attribute(self, attr_name, value):
+        self.write_attributes(((attr_name, value),))
+
+    def write_attributes(self, attr_values):
+        attr_values = list(attr_values)
+        time.sleep(self.__latency([name for name, _ in attr_values]))
+        self.__write_attributes(attr_values)
+
+    def write_attributes_asynch(self, attr_values, callback=None):
+        attr_values = list(attr_values)
+        attr_names = [attr_name for attr_name, _ in attr_values]
+        request = partial(self.__write_attributes, attr_values)
+        if callback is None:
+            return self.__request(request, attr_names)
+        self.__push_request(callback, "attr_written", attr_names, request)
+
+    def write_attributes_reply(self, req_id, timeout=0):
+        self.__reply(req_id)
+
+    def state(self):
+        return Tango.DevState.ON
+
+    def status(self):
+        return "The device is in ON state."
+
+    def __command(self, cmd_name, args):
+        """simulated commands: State and Status, the others return their
+        argument"""
+        cmd_name = cmd_name.lower()
+        if cmd_name == "state":
+            return self.state()
+        if cmd_name == "status":
+            return self.status()
+        return args[0] if args else None
+
+    def command_inout(self, cmd_name, *args, **kwargs):
+        return self.__command(cmd_name, args)
+
+    def command_inout_asynch(self, cmd_name, *args):
+        if args and hasattr(args[-1], "cmd_ended"):
+            request = partial(self.__command, cmd_name, args[:-1])
+            self.__push_request(args[-1], "cmd_ended", (), request)
+            return
+        request = partial(self.__command, cmd_name, args)
+        return self.__request(request, ())
+
+    def command_inout_reply(self, req_id, timeout=0):
+        return self.__reply(req_id)
+
+    def _change_event(self, attr_name):
+        """builds a change event of the attribute (an error event on an
+        injected fault)"""
+        name = "{0}/{1}".format(self.__name, attr_name)
+        try:
+            attr_value = self.__value(attr_name, "DeviceProxy.push_event")
+        except Tango.DevFailed:
+            return _TangoInfo(device=self, attr_name=name, event="change",
+                              attr_value=None, err=True,
+                              errors=sys.exc_info()[1].args)
+        return _TangoInfo(device=self, attr_name=name, event="change",
+                          attr_value=attr_value, err=False, errors=())
+
+    def __config_event(self, attr_name):
+        return _TangoInfo(
+            device=self, attr_name="{0}/{1}".format(self.__name, attr_name),
+            event="attr_conf", err=False, errors=(),
+            attr_conf=_tango_config(self._get_spec(attr_name)))
+
+    def subscribe_event(self, attr_name, event_type, callback, filters=(),
+                        stateless=False, extract_as=None):
+        """subscribes to the change (emitted at the spec rate) or config
+        event of an attribute. As in tango, the current value (or config)
+        is pushed at once. Attributes without events (rate 0) only accept
+        stateless subscriptions (which then never receive events)"""
+        push = getattr(callback, "push_event", callback)
+        if event_type == Tango.EventType.ATTR_CONF_EVENT:
+            with self.__lock:
+                evt_id = next(self.__ids)
+                self.__subscriptions[evt_id] = None
+            push(self.__config_event(attr_name))
+            return evt_id
+        if event_type != Tango.EventType.CHANGE_EVENT:
+            _throw("API_UnsupportedFeature",
+                   "simulated devices only emit change and config events",
+                   "DeviceProxy.subscribe_event")
+        if not self._get_spec(attr_name).rate:
+            if not stateless:
+                _throw("API_EventPropertiesNotSet",
+                       "event properties of {0}/{1} not set".format(
+                           self.__name, attr_name),
+                       "DeviceProxy.subscribe_event")
+            subscription = None
+        else:
+            subscription = _Subscription(self, attr_name, callback)
+        with self.__lock:
+            evt_id = next(self.__ids)
+            self.__subscriptions[evt_id] = subscription
+        if subscription is not None:
+            push(self._change_event(attr_name))
+            self.__simulator._register(subscription)
+        return evt_id
+
+    def unsubscribe_event(self, evt_id):
+        with self.__lock:
+            if self.__subscriptions.pop(evt_id, False) is not False:
+                return
+        _throw("API_EventNotFound", "event {0} not found".format(evt_id),
+               "DeviceProxy.unsubscribe_event")
+
+    def __repr__(self):
+        return "<simulated DeviceProxy({0})>".format(self.__name)
+
+
+class TangoSimulator(_SpecRegistry):
+    """Simulated tango devices for the tango plugin.
+
+    Attributes are described with :meth:`add_attribute` (unknown attributes
+    get a default :class:`AttributeSpec` built from the keyword arguments
+    given here). Once installed, the tango plugin connects to simulated
+    :class:`DeviceProxy` objects instead of real devices"""
+
+    def __init__(self, **default_spec):
+        if Tango is None:
+            raise ImportError("TangoSimulator needs PyTango")
+        _SpecRegistry.__init__(self, **default_spec)
+        self.__engine = _EventEngine()
+
+    def device_proxy(self, name):
+        """creates a simulated DeviceProxy"""
+        return DeviceProxy(name, self)
+
+    def _register(self, subscription):
+        self.__engine.register(subscription)
+
+    def _call_later(self, delay, fn, *args):
+        self.__engine.call_later(delay, fn, *args)
+
+    def install(self):
+        """makes the tango plugin use simulated devices (existing
+        connections are dropped)"""
+        from qarbon.tango import proxy_pool
+        proxy_pool().set_proxy_factory(self.device_proxy)
+
+    def uninstall(self):
+        """makes the tango plugin use real devices again"""
+        from qarbon.tango import proxy_pool
+        proxy_pool().set_proxy_factory(None)
+
+
+def main():
+    import qarbon.log
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    qarbon.log.initialize(log_level='info')
+
+    factory = Factory(rate=rate)
+    counter = [0]
+    def on_change():
+        counter[0] += 1
+    attrs = [factory.get_attribute("sim/dev/{0}/value".format(i))
+             for i in range(n)]
+    for attr in attrs:
+        attr.valueChanged.connect(on_change)
+    start = time.time()
+    time.sleep(5)
+    print("{0} events/s ({1} attributes at {2} Hz)".format(
+        counter[0] / (time.time() - start), n, rate))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+"""Aggregated state summaries.
+
+A :class:`StateSummary` follows the state of many devices and keeps, per
+group, the number of devices in each :class:`~qarbon.core.State` and the
+worst state. Each state change costs O(1); group summaries are published
+at a throttled rate::
+
+    from qarbon.summary import StateSummary
+
+    summary = StateSummary(max_rate=2)
+    summary.summaryChanged.connect(on_summary)
+    for name in vacuum_devices:
+        summary.watch(factory.get_attribute(name + "/state"),
+                      groups=("vacuum", "all"))
+"""
+
+__all__ = ["SEVERITY", "state_from_value", "StateSummary"]
+
+import time
+import threading
+from functools import partial
+
+from qarbon.core import Signal, State
+
+#: severity of each state (the higher, the worse)
+SEVERITY = {
+    State.On: 0, State.Off: 0, State.Close: 0, State.Open: 0,
+    State.Insert: 0, State.Extract: 0,
+    State.Standby: 1,
+    State.Running: 2, State.Moving: 2,
+    State.Init: 3,
+    State.Disable: 4,
+    State.Unknown: 5, State.Disconnected: 5, State._Invalid: 5,
+    State.Alarm: 6,
+    State.Fault: 7,
+}
+
+#: states ordered from the worst to the best
+_BY_SEVERITY = sorted(SEVERITY, key=lambda state: -SEVERITY[state])
+
+
+def state_from_value(attr_value):
+    """converts a state AttributeValue into a State (errors give
+    State.Unknown)"""
+    if attr_value is None or attr_value.error:
+        return State.Unknown
+    try:
+        return State(int(attr_value.r_magnitude))
+    except Exception:
+        return State.Unknown
+
+
+class _Group(object):
+
+    def __init__(self):
+        self.counts = dict((state, 0) for state in SEVERITY)
+        self.size = 0
+
+    def worst(self):
+        # constant time: the number of states is fixed
+        for state in _BY_SEVERITY:
+            if self.counts[state]:
+                return state
+        return None
+
+
+class StateSummary(object):
+    """Incremental per group state counters.
+
+    summaryChanged is emitted (from a timer thread) with the group name
+    for every group which changed since the last publication, at most
+    *max_rate* times per second.
+
+    :param max_rate: maximum publication rate (Hz). None or 0 publishes
+                     on every change [default: 2]"""
+
+    summaryChanged = Signal()
+
+    def __init__(self, max_rate=2.0):
+        self.__lock = threading.Lock()
+        self.__max_rate = max_rate
+        self.__groups = {}   # group name -> _Group
+        self.__members = {}  # key -> (state, groups)
+        self.__watched = {}  # key -> (attribute, slot)
+        self.__dirty = set()
+        self.__timer = None
+        self.__last_publish = 0.0
+
+    def watch(self, attribute, groups=(), key=None):
+        """follows the state of a device through its state attribute (any
+        attribute with a valueChanged signal and a get_value method).
+
+        :param attribute: the state attribute
+        :param groups: names of the groups the device belongs to
+        :param key: member key [default: the device name]"""
+        if key is None:
+            key = attribute.device.name
+        slot = partial(self.__on_change, attribute, key)
+        with self.__lock:
+            if key in self.__watched:
+                return
+            self.__watched[key] = attribute, slot
+        self.add(key, groups)
+        attribute.valueChanged.connect(slot)
+        attribute.get_value().add_done_callback(partial(self.__on_value, key))
+
+    def unwatch(self, key):
+        with self.__lock:
+            attribute, slot = self.__watched.pop(key, (None, None))
+        if slot is not None:
+            attribute.valueChanged.disconnect(slot)
+        self.remove(key)
+
+    def __on_change(self, attribute, key):
+        attribute.get_value().add_done_callback(partial(self.__on_value, key))
+
+    def __on_value(self, key, attr_value):
+        try:
+            attr_value = attr_value.result()
+        except Exception:
+            attr_value = None
+        self.update(key, state_from_value(attr_value))
+
+    def add(self, key, groups, state=State.Unknown):
+        """adds a member (ex: a device name) to the given groups"""
+        groups = tuple(groups)
+        with self.__lock:
+            if key in self.__members:
+                return
+            self.__members[key] = state, groups
+            for group_name in groups:
+                group = self.__groups.get(group_name)
+                if group is None:
+                    group = self.__groups[group_name] = _Group()
+                group.size += 1
+                group.counts[state] += 1
+                self.__dirty.add(group_name)
+        self.__schedule()
+
+    def remove(self, key):
+        """removes a member from its groups"""
+        with self.__lock:
+            state, groups = self.__members.pop(key, (None, ()))
+            for group_name in groups:
+                group = self.__groups[group_name]
+                group.size -= 1
+                group.counts[state] -= 1
+                self.__dirty.add(group_name)
+        self.__schedule()
+
+    def update(self, key, state):
+        """sets the state of a member: O(number of groups of the member)"""
+        with self.__lock:
+            member = self.__members.get(key)
+            if member is None or member[0] == state:
+                return
+            old_state, groups = member
+            self.__members[key] = state, groups
+            for group_name in groups:
+                counts = self.__groups[group_name].counts
+                counts[old_state] -= 1
+                counts[state] += 1
+                self.__dirty.add(group_name)
+        self.__schedule()
+
+    def __schedule(self):
+        with self.__lock:
+            if not self.__dirty or self.__timer is not None:
+                return
+            wait = 0.0
+            if self.__max_rate:
+                wait = self.__last_publish + 1.0 / self.__max_rate - \
+                    time.time()
+            if wait > 0:
+                self.__timer = threading.Timer(wait, self.publish)
+                self.__timer.daemon = True
+                self.__timer.start()
+                return
+        self.publish()
+
+    def publish(self):
+        """emits summaryChanged for every changed group now"""
+        with self.__lock:
+            self.__timer = None
+            self.__last_publish = time.time()
+            dirty, self.__dirty = self.__dirty, set()
+        for group_name in dirty:
+            self.summaryChanged.emit(group_name)
+
+    def groups(self):
+        """returns the list of group names"""
+        with self.__lock:
+            return list(self.__groups)
+
+    def get_state(self, key):
+        """returns the state of a member"""
+        return self.__members[key][0]
+
+    def get_counts(self, group_name):
+        """returns dict<State, number of members> of a group (only states
+        with members are present)"""
+        with self.__lock:
+            counts = self.__groups[group_name].counts
+            return dict((state, count) for state, count in counts.items()
+                        if count)
+
+    def get_worst(self, group_name):
+        """returns the worst state of a group (None if the group is
+        empty)"""
+        with self.__lock:
+            return self.__groups[group_name].worst()
+
+    def get_summary(self, group_name):
+        """returns a tuple (number of members, counts, worst state) of a
+        group"""
+        with self.__lock:
+            group = self.__groups[group_name]
+            counts = dict((state, count) for state, count
+                          in group.counts.items() if count)
+            return group.size, counts, group.worst()
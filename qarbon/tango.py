@@ -11,26 +11,45 @@
 
 """Tango plugin for qarbon."""
 
-from weakref import WeakValueDictionary
+import re
+import sys
+import time
+import heapq
+import atexit
+import fnmatch
+import datetime
+import threading
+from weakref import WeakValueDictionary, WeakKeyDictionary, ref
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 from functools import partial
 from concurrent import futures
 
 import PyTango as Tango
 
 from qarbon import log
+from qarbon import config
 from qarbon.external.pint import Quantity
-from qarbon.executor import submit
+from qarbon.cache import DiskCache
+from qarbon.executor import submit, submit_limited
 from qarbon.core import Signal
 from qarbon.core import Device as _Device
 from qarbon.core import Attribute as _Attribute
 from qarbon.core import Factory as _Factory
 from qarbon.core import Quality, Access, DisplayLevel
-from qarbon.core import AttributeConfig, AttributeValue
+from qarbon.core import AttributeConfig, AttributeValue, LazyAttributeValue
 
 __NO_STR_VALUE = Tango.constants.AlrmValueNotSpec, Tango.constants.StatusNotSet
 Dict = WeakValueDictionary
+# SimpleQueue (python >= 3.7) is reentrant: put() can be called from __del__
+_SimpleQueue = getattr(queue, "SimpleQueue", queue.Queue)
 str_2_obj = Tango.str_2_obj
 
+#: array values are extracted as numpy arrays (in their native dtype)
+_NUMPY = Tango.ExtractAs.Numpy
+
 
 def quantity_t2q(value, units=None, fmt=None):
     res = Quantity(value, units=units)
@@ -88,8 +107,14 @@ def access_t2q(access):
     return Access(access)
 
 
+__QUALITY_MAP = {}
 def quality_t2q(quality):
-    return Quality(int(quality))
+    quality = int(quality)
+    try:
+        return __QUALITY_MAP[quality]
+    except KeyError:
+        result = __QUALITY_MAP[quality] = Quality(quality)
+        return result
 
 
 __NULL_DESC = Tango.constants.DescNotSet, Tango.constants.DescNotSpec
@@ -113,7 +138,7 @@ def standard_display_format_t2q(dtype, fmt):
             pass
         elif Tango.is_int_type(dtype, inc_array=True):
             fmt = '%d'
-        elif tango_cfg.data_type in __S_TYPES:
+        elif dtype in __S_TYPES:
             fmt = '%s'
     return fmt
 
@@ -170,116 +195,1385 @@ def attr_config_t2q(tango_cfg):
     return result
 
 
+_CONFIG_FIELDS = ("name", "label", "description", "format", "unit",
+                  "display_unit", "standard_unit", "min_value", "max_value",
+                  "min_alarm", "max_alarm")
+_CONFIG_INT_FIELDS = ("data_type", "data_format", "disp_level", "writable")
+
+
+def attr_config_t2dict(tango_cfg):
+    """Converts a tango attribute config into a dict of plain python objects
+    (suitable to be persisted). Use :func:`attr_config_dict2t` to convert it
+    back"""
+    result = dict((field, getattr(tango_cfg, field))
+                  for field in _CONFIG_FIELDS)
+    for field in _CONFIG_INT_FIELDS:
+        result[field] = int(getattr(tango_cfg, field))
+    result["min_warning"] = tango_cfg.alarms.min_warning
+    result["max_warning"] = tango_cfg.alarms.max_warning
+    return result
+
+
+class _TangoInfo(object):
+    """Minimal stand-in for tango info objects"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def attr_config_dict2t(cfg_dict):
+    """Builds an object equivalent to a tango attribute config (as far as
+    :func:`attr_config_t2q` is concerned) from the result of
+    :func:`attr_config_t2dict`"""
+    result = _TangoInfo(**cfg_dict)
+    result.data_type = Tango.CmdArgType.values[cfg_dict["data_type"]]
+    result.alarms = _TangoInfo(min_warning=cfg_dict["min_warning"],
+                               max_warning=cfg_dict["max_warning"])
+    return result
+
+
+_CONFIG_STORE = None
+def _config_store():
+    """returns the persistent attribute config cache or None if disabled"""
+    global _CONFIG_STORE
+    if not config.TANGO_CONFIG_CACHE:
+        return None
+    if _CONFIG_STORE is None:
+        try:
+            _CONFIG_STORE = DiskCache("tango_attribute_config")
+        except Exception:
+            log.warning("Failed to open attribute config cache. Disabling it",
+                        exc_info=1)
+            config.TANGO_CONFIG_CACHE = False
+    return _CONFIG_STORE
+
+
+def value_converter(attr_cfg, dtype):
+    """Compiles the conversion of tango read/write values of the given type
+    for the given AttributeConfig: the type check, the units and the display
+    format are resolved once.
+
+    :return: a function converting a tango value into a Quantity (None
+             stays None) or None if values of this type are not converted
+    :rtype: callable"""
+    if not Tango.is_numerical_type(dtype):
+        return None
+    units = attr_cfg.unit
+    if units is not None:
+        # a UnitsContainer avoids copying/parsing units on every value
+        units = Quantity(1, units=units).units
+    fmt = attr_cfg.display_format
+    Q_ = Quantity
+    if fmt is None:
+        def convert(value):
+            if value is None:
+                return None
+            return Q_(value, units)
+    else:
+        default_format = fmt + Q_(1, units).default_format
+        def convert(value):
+            if value is None:
+                return None
+            result = Q_(value, units)
+            result.default_format = default_format
+            return result
+    return convert
+
+
+#: dict<AttributeConfig, (dtype, converter)>
+_CONVERTERS = WeakKeyDictionary()
+
+def get_value_converter(attr_cfg, dtype):
+    """Returns the (cached) result of :func:`value_converter`"""
+    try:
+        cached_dtype, convert = _CONVERTERS[attr_cfg]
+        if cached_dtype == dtype:
+            return convert
+    except KeyError:
+        pass
+    convert = value_converter(attr_cfg, dtype)
+    _CONVERTERS[attr_cfg] = dtype, convert
+    return convert
+
+
 def attr_value_t2q(attr_cfg, tango_attr_value):
     if tango_attr_value.has_failed:
+        # read_attributes reports the failure of a single attribute in its
+        # value instead of raising
+        raise Tango.DevFailed(*tango_attr_value.get_err_stack())
+    if tango_attr_value.is_empty:
         pass
-    else:
-        if tango_attr_value.is_empty:
-            pass
-
-    dtype = tango_attr_value.type
-    fmt = attr_cfg.display_format
-    numerical = Tango.is_numerical_type(dtype)
 
+    convert = get_value_converter(attr_cfg, tango_attr_value.type)
     r_value = tango_attr_value.value
     w_value = tango_attr_value.w_value
-    units = attr_cfg.unit
-    if numerical:
-        if r_value is not None:
-            r_value = Quantity(r_value, units=units)
-            if fmt is not None:
-                r_value.default_format = fmt + r_value.default_format
-        if w_value is not None:
-            w_value = Quantity(w_value, units=units)
-            if fmt is not None:
-                w_value.default_format = fmt + w_value.default_format
-        
     quality = quality_t2q(tango_attr_value.quality)
+    r_timestamp = tango_attr_value.time.todatetime()
+
+    if attr_cfg.ndim:
+        # spectrum/image: keep the numpy arrays as they come from tango and
+        # only build quantities if someone asks for them
+        return LazyAttributeValue(r_magnitude=r_value, r_quality=quality,
+                                  r_timestamp=r_timestamp,
+                                  w_magnitude=w_value, config=attr_cfg,
+                                  ndim=attr_cfg.ndim, convert=convert)
+
+    if convert is not None:
+        r_value, w_value = convert(r_value), convert(w_value)
     value = AttributeValue(r_value=r_value, r_quality=quality,
-                           r_timestamp=tango_attr_value.time.todatetime(),
+                           r_timestamp=r_timestamp,
                            w_value=w_value, config=attr_cfg)
     return value
 
 
+def _set_future(future, result=None, exc=None):
+    if not future.set_running_or_notify_cancel():
+        return
+    if exc is None:
+        future.set_result(result)
+    else:
+        future.set_exception(exc)
+
+
+class _Scheduler(object):
+    """Single thread running delayed calls for the whole plugin (instead of
+    one threading.Timer thread per delayed call). The calls must be short
+    and never block (batch flushes run here): user callbacks must be handed
+    over to the executor"""
+
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__schedule = []  # heap of [due time, sequence, fn, args]
+        self.__seq = 0
+        self.__thread = None
+
+    def call_later(self, delay, fn, *args):
+        """calls fn(*args) in *delay* seconds. Returns an entry which can be
+        given to :meth:`cancel`"""
+        with self.__cond:
+            self.__seq += 1
+            entry = [time.time() + delay, self.__seq, fn, args]
+            heapq.heappush(self.__schedule, entry)
+            if self.__schedule[0] is entry:
+                self.__cond.notify()
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run,
+                                                 name="qarbon.tango.Scheduler")
+                self.__thread.daemon = True
+                self.__thread.start()
+        return entry
+
+    def cancel(self, entry):
+        """cancels a call (no effect if it is already running)"""
+        entry[2] = None
+
+    def __next_due(self):
+        with self.__cond:
+            while True:
+                if not self.__schedule:
+                    self.__cond.wait()
+                    continue
+                due = self.__schedule[0][0]
+                now = time.time()
+                if due > now:
+                    self.__cond.wait(due - now)
+                    continue
+                _, _, fn, args = heapq.heappop(self.__schedule)
+                if fn is not None:
+                    return fn, args
+
+    def __run(self):
+        while True:
+            fn, args = self.__next_due()
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("Error in delayed call %s", fn)
+
+
+__SCHEDULER = None
+__SCHEDULER_LOCK = threading.Lock()
+def scheduler():
+    """returns the :class:`_Scheduler` of the tango plugin"""
+    global __SCHEDULER
+    with __SCHEDULER_LOCK:
+        if __SCHEDULER is None:
+            __SCHEDULER = _Scheduler()
+    return __SCHEDULER
+
+
+class _Batcher(object):
+    """Collects items arriving within *window* seconds of the first one and
+    then hands the whole batch (a dict) to *flush*. Items are merged into the
+    batch with :meth:`add`. A window <= 0 flushes on every add."""
+
+    def __init__(self, window, flush):
+        self.window = window
+        self.__flush = flush
+        self.__lock = threading.Lock()
+        self.__batch = {}
+        self.__timer = None
+
+    def add(self, key, merge):
+        """merges an item into the current batch:
+        batch[key] = merge(batch.get(key))"""
+        with self.__lock:
+            batch = self.__batch
+            batch[key] = merge(batch.get(key))
+            if self.window <= 0:
+                self.__batch = {}
+            elif self.__timer is None:
+                self.__timer = scheduler().call_later(self.window, self.flush)
+                return
+            else:
+                return
+        self.__flush(batch)
+
+    def flush(self):
+        """flushes the current batch now"""
+        with self.__lock:
+            if self.__timer is not None:
+                scheduler().cancel(self.__timer)
+                self.__timer = None
+            batch, self.__batch = self.__batch, {}
+        if batch:
+            self.__flush(batch)
+
+
+def _fan_out(batch, attr_names, attr_values=None, exc=None):
+    """resolves the futures of a read batch (dict<attr name, list<Future>>)
+    with the corresponding values (or with an exception)"""
+    if attr_values is None:
+        attr_values = len(attr_names) * [None]
+    for attr_name, attr_value in zip(attr_names, attr_values):
+        for future in batch[attr_name]:
+            _set_future(future, attr_value, exc)
+
+
+def _resolve_writes(batch, exc=None):
+    """resolves the futures of a write batch (dict<attr name, (value,
+    list<Future>)>)"""
+    for _, fs in batch.values():
+        for future in fs:
+            _set_future(future, None, exc)
+
+
+def _check_sent(on_error, send_future):
+    """calls on_error(exception) if sending an asynchronous request failed"""
+    if send_future.cancelled():
+        on_error(futures.CancelledError())
+        return
+    exc = send_future.exception()
+    if exc is not None:
+        on_error(exc)
+
+
+class _AsynchCallback(object):
+    """PyTango asynchronous request callback. Calls on_reply(argout, None)
+    or, on error, on_reply(None, DevFailed)"""
+
+    def __init__(self, on_reply):
+        self.__on_reply = on_reply
+
+    def _reply(self, event):
+        if event.err:
+            self.__on_reply(None, Tango.DevFailed(*event.errors))
+        else:
+            self.__on_reply(getattr(event, "argout", None), None)
+
+    attr_read = _reply
+    attr_written = _reply
+    cmd_ended = _reply
+
+
+_PUSH_MODEL = False
+def _push_model():
+    """makes tango push the replies of asynchronous requests to their
+    callbacks (done once)"""
+    global _PUSH_MODEL
+    if not _PUSH_MODEL:
+        Tango.ApiUtil.instance().set_asynch_cb_sub_model(
+            Tango.cb_sub_model.PUSH_CALLBACK)
+        _PUSH_MODEL = True
+
+
+def _asynch_io():
+    """tells if the asynchronous I/O mode is active (and, the first time,
+    makes tango push the replies to the callbacks)"""
+    if config.TANGO_IO_MODE != "asynch":
+        return False
+    _push_model()
+    return True
+
+
+def _attr_value_t2q_result(attr_cfg, tango_attr_value):
+    """returns (AttributeValue, None) or (None, exception) if the value
+    can't be converted (ex: the attribute failed)"""
+    try:
+        return attr_value_t2q(attr_cfg, tango_attr_value), None
+    except Exception:
+        return None, sys.exc_info()[1]
+
+
+def _resolve_value(fs, tango_attr_value, attr_cfg_future):
+    try:
+        attr_cfg = attr_cfg_future.result()
+    except Exception:
+        attr_value, exc = None, sys.exc_info()[1]
+    else:
+        attr_value, exc = _attr_value_t2q_result(attr_cfg, tango_attr_value)
+    for future in fs:
+        _set_future(future, attr_value, exc)
+
+
+def _append(item, items):
+    if items is None:
+        return [item]
+    items.append(item)
+    return items
+
+
+def _replace(value, future, entry):
+    """merges a write into a write batch entry (value, list<Future>): the
+    new value replaces the pending one (last value wins)"""
+    if entry is None:
+        return value, [future]
+    entry[1].append(future)
+    return value, entry[1]
+
+
+def attr_write_value_q2t(attr_cfg, value):
+    """Converts a value to be written into the tango attribute units: a
+    Quantity is converted to the attribute unit and its magnitude is
+    returned. Other values are returned unchanged"""
+    if isinstance(value, Quantity):
+        if attr_cfg.unit is not None:
+            value = value.to(attr_cfg.unit)
+        value = value.magnitude
+    return value
+
+
+def attr_value_q2dict(attr_value):
+    """Converts an AttributeValue into a dict of picklable builtin types
+    (the inverse of :func:`attr_value_dict2q`). The unit comes from the
+    attribute config so that lazy (array) values are not converted"""
+    ndim = attr_value.r_ndim or 0
+    unit = getattr(attr_value.config, "unit", None)
+    if unit is not None:
+        unit = str(getattr(unit, "units", unit))
+    quantity = unit is not None
+    if not quantity and not ndim:
+        r_value = attr_value.r_value
+        quantity = isinstance(r_value, Quantity)
+        if quantity:
+            unit = str(r_value.units)
+    r_timestamp = attr_value.r_timestamp
+    return dict(magnitude=attr_value.r_magnitude,
+                quality=attr_value.r_quality.value,
+                timestamp=time.mktime(r_timestamp.timetuple()) +
+                          r_timestamp.microsecond * 1E-6,
+                unit=unit, quantity=quantity, ndim=ndim)
+
+
+def attr_value_dict2q(value_dict, attr_cfg=None):
+    """Builds a stale AttributeValue from the result of
+    :func:`attr_value_q2dict`"""
+    magnitude = value_dict["magnitude"]
+    units = value_dict["unit"]
+    convert = None
+    if value_dict["quantity"]:
+        convert = lambda m: Quantity(m, units)
+    kwargs = dict(r_quality=quality_t2q(value_dict["quality"]),
+                  r_timestamp=datetime.datetime.fromtimestamp(
+                      value_dict["timestamp"]),
+                  config=attr_cfg)
+    if value_dict["ndim"]:
+        result = LazyAttributeValue(r_magnitude=magnitude,
+                                    ndim=value_dict["ndim"], convert=convert,
+                                    **kwargs)
+    else:
+        if convert is not None:
+            magnitude = convert(magnitude)
+        result = AttributeValue(r_value=magnitude, **kwargs)
+    result.stale = True
+    return result
+
+
+class _Snapshot(object):
+    """Persistent store of the last known value of each attribute (see
+    :data:`qarbon.config.TANGO_SNAPSHOT`). Values of all registered devices
+    are saved every :data:`qarbon.config.TANGO_SNAPSHOT_PERIOD` seconds
+    and on exit"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__devices = WeakValueDictionary()
+        self.__store = DiskCache("tango_last_values")
+        self.__timer = None
+        atexit.register(self.save)
+        self.__schedule()
+
+    def __schedule(self):
+        period = config.TANGO_SNAPSHOT_PERIOD
+        if period:
+            self.__timer = threading.Timer(period, self.__periodic_save)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def __periodic_save(self):
+        try:
+            self.save()
+        finally:
+            self.__schedule()
+
+    def register(self, device):
+        with self.__lock:
+            self.__devices[id(device)] = device
+
+    def get(self, name):
+        """returns the stored value dict of the given attribute (full name)
+        or None"""
+        return self.__store.get(name)
+
+    def save(self):
+        """saves the current values of all registered devices"""
+        with self.__lock:
+            devices = list(self.__devices.values())
+        items = []
+        for device in devices:
+            items.extend(device._snapshot_items())
+        if items:
+            try:
+                self.__store.update(items)
+            except Exception:
+                log.debug("Failed to save last known values", exc_info=1)
+
+
+_SNAPSHOT = None
+def _snapshot():
+    """returns the last known value store or None if disabled"""
+    global _SNAPSHOT
+    if not config.TANGO_SNAPSHOT:
+        return None
+    if _SNAPSHOT is None:
+        try:
+            _SNAPSHOT = _Snapshot()
+        except Exception:
+            log.warning("Failed to open last known value cache. Disabling it",
+                        exc_info=1)
+            config.TANGO_SNAPSHOT = False
+    return _SNAPSHOT
+
+
+class _DbCache(object):
+    """Time limited cache of tango database query results (see
+    :data:`qarbon.config.TANGO_DB_CACHE_TTL`), optionally persistent
+    (:data:`qarbon.config.TANGO_DB_CACHE_PERSIST`)"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__db = None
+        self.__store = None
+        self.__items = {}  # key -> (value, stamp)
+
+    @property
+    def database(self):
+        """the tango Database (created on first use)"""
+        with self.__lock:
+            if self.__db is None:
+                self.__db = Tango.Database()
+        return self.__db
+
+    def __disk(self):
+        if not config.TANGO_DB_CACHE_PERSIST:
+            return None
+        if self.__store is None:
+            try:
+                self.__store = DiskCache("tango_database")
+            except Exception:
+                log.warning("Failed to open database cache. Disabling it",
+                            exc_info=1)
+                config.TANGO_DB_CACHE_PERSIST = False
+        return self.__store
+
+    def get(self, key, fetch):
+        """returns the cached value for key or, if missing or expired, the
+        result of fetch() (which is then cached)"""
+        ttl = config.TANGO_DB_CACHE_TTL
+        item = self.__items.get(key)
+        if item is not None and time.time() - item[1] <= ttl:
+            return item[0]
+        store = self.__disk()
+        if store is not None:
+            item = store.get_item(key)
+            if item is not None and time.time() - item[1] <= ttl:
+                self.__items[key] = item
+                return item[0]
+        value = fetch()
+        self.__items[key] = value, time.time()
+        if store is not None:
+            try:
+                store.set(key, value)
+            except Exception:
+                log.debug("Failed to store %s", key, exc_info=1)
+        return value
+
+    def clear(self):
+        self.__items.clear()
+        store = self.__disk()
+        if store is not None:
+            store.clear()
+
+
+__DB_CACHE = _DbCache()
+def db_cache():
+    """returns the tango database query cache"""
+    return __DB_CACHE
+
+
+def is_pattern(name):
+    """tells if the name contains wildcards (*, ? or [])"""
+    return "*" in name or "?" in name or "[" in name
+
+
+_NON_STAR_WILDCARDS = re.compile(r"\?|\[[^\]]*\]")
+def _star_pattern(pattern):
+    """translates a wildcard pattern into a broader one only using * (the
+    only wildcard understood by the tango database)"""
+    return re.sub(r"\*+", "*", _NON_STAR_WILDCARDS.sub("*", pattern))
+
+
+class _ProxyPool(object):
+    """DeviceProxy objects shared by all devices (of all factories) with the
+    same name. Proxies are created on first use. A failed connection is
+    kept (and reported) until its backoff delay expires; the delay doubles
+    on every consecutive failure, from
+    :data:`qarbon.config.TANGO_RECONNECT_MIN` up to
+    :data:`qarbon.config.TANGO_RECONNECT_MAX` seconds"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__proxies = {}  # name -> [future, failures, retry time]
+        self.__proxy_factory = Tango.DeviceProxy
+
+    def set_proxy_factory(self, proxy_factory=None):
+        """sets the callable creating the proxies from a device name (ex: a
+        simulator, see :class:`qarbon.simulation.TangoSimulator`) and drops
+        the existing proxies.
+
+        :param proxy_factory: callable(name) -> DeviceProxy
+                              [default: None, meaning Tango.DeviceProxy]"""
+        if proxy_factory is None:
+            proxy_factory = Tango.DeviceProxy
+        with self.__lock:
+            self.__proxy_factory = proxy_factory
+            self.__proxies.clear()
+
+    def get(self, name):
+        """returns a Future of the DeviceProxy for the given device name.
+
+        The first caller which needs a (new) connection claims the pool
+        entry and connects in its own thread; concurrent callers get the
+        claimed future. A connection is never submitted to the executor:
+        callers are often executor workers themselves and would otherwise
+        wait for a task queued behind them."""
+        name = name.lower()
+        with self.__lock:
+            entry = self.__proxies.get(name)
+            if entry is None:
+                entry = self.__proxies[name] = [None, 0, 0.0]
+            future = entry[0]
+            if future is not None:
+                if not future.done() or future.exception() is None:
+                    return future
+                if time.time() < entry[2]:
+                    return future
+            entry[0] = future = futures.Future()
+            future.set_running_or_notify_cancel()
+            proxy_factory = self.__proxy_factory
+        try:
+            proxy = proxy_factory(name)
+        except Exception:
+            with self.__lock:
+                entry[1] += 1
+                delay = min(config.TANGO_RECONNECT_MIN * 2 ** (entry[1] - 1),
+                            config.TANGO_RECONNECT_MAX)
+                entry[2] = time.time() + delay
+            log.debug("Failed to connect to %s. Retry in %ss", name, delay)
+            future.set_exception(sys.exc_info()[1])
+        else:
+            with self.__lock:
+                entry[1] = 0
+            future.set_result(proxy)
+        return future
+
+
+__PROXY_POOL = _ProxyPool()
+def proxy_pool():
+    """returns the pool of DeviceProxy objects of the tango plugin"""
+    return __PROXY_POOL
+
+
 class Device(_Device):
 
     def __init__(self, name):
         _Device.__init__(self, name)
+        self.__lock = threading.RLock()
         self.__attr_value_cache = {}
+        self.__attr_value_stamp = {}
+        self.__stale_values = {}
         self.__attr_config_cache = {}
-        self.__device_future = submit(Tango.DeviceProxy, name)
+        self.__read_batcher = _Batcher(config.TANGO_READ_BATCH_WINDOW,
+                                       self.__read_batch)
+        self.__write_batcher = _Batcher(config.TANGO_WRITE_BATCH_WINDOW,
+                                        self.__write_batch)
+        self.__write_in_flight = False
+        self.__write_pending = {}
+        snapshot = _snapshot()
+        if snapshot is not None:
+            snapshot.register(self)
 
     @property
     def hw_device(self):
-        return self.__device_future.result()   
+        """the DeviceProxy. It is created (or, after a failure, retried)
+        on first use"""
+        return proxy_pool().get(self.name).result()
+
+    def _submit(self, fn, *args, **kwargs):
+        """submits a call to the executor, subject to the rate limit of this
+        device (see :func:`qarbon.executor.set_rate_limit`)"""
+        return submit_limited(self.name.lower(), fn, *args, **kwargs)
+
+    def __attr_value_t2q(self, attr_name, tango_attr_value):
+        attr_cfg = self.__attribute_config(attr_name)
+        return attr_value_t2q(attr_cfg, tango_attr_value)
+
+    def __attr_values_t2q(self, attr_names, tango_attr_values):
+        """converts the values of a read_attributes. Returns a list of
+        (AttributeValue, None) or, for attributes which failed, (None,
+        exception)"""
+        attr_cfgs = self.__attribute_configs(attr_names)
+        return [_attr_value_t2q_result(attr_cfg, tango_attr_value)
+                for attr_cfg, tango_attr_value in zip(attr_cfgs,
+                                                      tango_attr_values)]
 
     def __read_attribute_value(self, attr_name):
         attr_name = attr_name.lower()
-        tango_attr_value = self.hw_device.read_attribute(attr_name)
-        try:
-            attr_cfg = self.__attr_config_cache[attr_name]
-        except KeyError:
-            attr_cfg = self.__read_attribute_config(attr_name)
-        attr_value = attr_value_t2q(attr_cfg, tango_attr_value)
-        return attr_value
+        tango_attr_value = self.hw_device.read_attribute(attr_name,
+                                                          extract_as=_NUMPY)
+        return self.__attr_value_t2q(attr_name, tango_attr_value)
+
+    def __read_attribute_values(self, attr_names):
+        tango_attr_values = self.hw_device.read_attributes(attr_names,
+                                                           extract_as=_NUMPY)
+        return self.__attr_values_t2q(attr_names, tango_attr_values)
+
+    def __resolve_values(self, batch, attr_names, tango_attr_values):
+        """resolves the futures of a read batch from tango values without
+        blocking: each value is converted once its config is available"""
+        for attr_name, tango_attr_value in zip(attr_names, tango_attr_values):
+            attr_cfg = self.get_attribute_config(attr_name)
+            attr_cfg.add_done_callback(partial(_resolve_value, batch[attr_name],
+                                               tango_attr_value))
+
+    def __read_attributes_asynch(self, batch, attr_names):
+        def on_reply(tango_attr_values, exc):
+            if exc is None:
+                self.__resolve_values(batch, attr_names, tango_attr_values)
+            else:
+                _fan_out(batch, attr_names, exc=exc)
+        self.hw_device.read_attributes_asynch(attr_names,
+                                              _AsynchCallback(on_reply),
+                                              extract_as=_NUMPY)
+
+    def _read_batch_asynch(self, batch):
+        """reads a batch (dict<attr name, list<Future>>) with an asynchronous
+        request: an executor thread is only used to send it and the reply is
+        pushed to a callback, so that no thread waits for it"""
+        _push_model()
+        attr_names = list(batch)
+        send_future = self._submit(self.__read_attributes_asynch, batch,
+                                   attr_names)
+        on_error = lambda exc: _fan_out(batch, attr_names, exc=exc)
+        send_future.add_done_callback(partial(_check_sent, on_error))
+
+    def __read_batch(self, batch):
+        """reads a batch (dict<attr name, list<Future>>) in one round trip"""
+        if _asynch_io():
+            self._read_batch_asynch(batch)
+            return
+        attr_names = list(batch)
+        batch_future = self._submit(self.__read_attribute_values, attr_names)
+
+        def fan_out(batch_future):
+            try:
+                results = batch_future.result()
+            except Exception:
+                _fan_out(batch, attr_names, exc=sys.exc_info()[1])
+                return
+            for attr_name, (attr_value, exc) in zip(attr_names, results):
+                for future in batch[attr_name]:
+                    _set_future(future, attr_value, exc)
+        batch_future.add_done_callback(fan_out)
+
+    def __write_values_q2t(self, batch, attr_names):
+        attr_cfgs = self.__attribute_configs(attr_names)
+        return [(attr_name, attr_write_value_q2t(attr_cfg,
+                                                 batch[attr_name][0]))
+                for attr_name, attr_cfg in zip(attr_names, attr_cfgs)]
+
+    def __write_attribute_values(self, batch, attr_names):
+        self.hw_device.write_attributes(self.__write_values_q2t(batch,
+                                                                attr_names))
+
+    def __write_attributes_asynch(self, batch, attr_names):
+        on_reply = lambda argout, exc: self.__writes_done(batch, exc)
+        self.hw_device.write_attributes_asynch(
+            self.__write_values_q2t(batch, attr_names),
+            _AsynchCallback(on_reply))
+
+    def __write_batch(self, batch):
+        """writes a batch (dict<attr name, (value, list<Future>)>) in one
+        round trip. Only one write is in flight per device: a batch arriving
+        meanwhile is merged into the pending one (last value wins) and sent
+        when the write in flight completes, so that writes are applied in
+        order"""
+        with self.__lock:
+            if self.__write_in_flight:
+                pending = self.__write_pending
+                for attr_name, (value, fs) in batch.items():
+                    entry = pending.get(attr_name)
+                    if entry is not None:
+                        fs = entry[1] + fs
+                    pending[attr_name] = value, fs
+                return
+            self.__write_in_flight = True
+        self.__send_writes(batch)
+
+    def __writes_done(self, batch, exc=None):
+        _resolve_writes(batch, exc)
+        with self.__lock:
+            batch, self.__write_pending = self.__write_pending, {}
+            if not batch:
+                self.__write_in_flight = False
+                return
+        self.__send_writes(batch)
+
+    def __send_writes(self, batch):
+        attr_names = list(batch)
+        if _asynch_io():
+            send_future = self._submit(self.__write_attributes_asynch, batch,
+                                       attr_names)
+            on_error = partial(self.__writes_done, batch)
+            send_future.add_done_callback(partial(_check_sent, on_error))
+            return
+        batch_future = self._submit(self.__write_attribute_values, batch,
+                                    attr_names)
+
+        def done(batch_future):
+            if batch_future.cancelled():
+                self.__writes_done(batch, futures.CancelledError())
+            else:
+                self.__writes_done(batch, batch_future.exception())
+        batch_future.add_done_callback(done)
+
+    def __full_name(self, attr_name):
+        return "{0}/{1}".format(self.name.lower(), attr_name)
 
     def __read_attribute_config(self, attr_name):
         attr_name = attr_name.lower()
         tango_cfg = self.hw_device.get_attribute_config_ex(attr_name)[0]
-        attr_cfg = attr_config_t2q(tango_cfg)
+        attr_cfg = self._update_attribute_config(attr_name, tango_cfg)
         return attr_cfg
 
+    def _update_attribute_config(self, attr_name, tango_cfg):
+        """converts a tango attribute config and stores it in the persistent
+        config cache (if enabled). Returns the AttributeConfig"""
+        return self.__update_attribute_configs(((attr_name, tango_cfg),))[0]
+
+    def __update_attribute_configs(self, items):
+        """converts tango attribute configs (sequence of (attr name, tango
+        config)) and stores them in the persistent config cache (if
+        enabled) in a single transaction. Returns the list of
+        AttributeConfig"""
+        attr_cfgs = [attr_config_t2q(tango_cfg) for _, tango_cfg in items]
+        store = _config_store()
+        if store is not None:
+            try:
+                store.update([(self.__full_name(attr_name.lower()),
+                               attr_config_t2dict(tango_cfg))
+                              for attr_name, tango_cfg in items])
+            except Exception:
+                log.debug("Failed to store configs of %s", self.name,
+                          exc_info=1)
+        return attr_cfgs
+
+    def __stored_attribute_config(self, attr_name):
+        """returns the AttributeConfig from the persistent config cache or
+        None if not available"""
+        store = _config_store()
+        if store is None:
+            return None
+        try:
+            cfg_dict = store.get(self.__full_name(attr_name))
+            if cfg_dict is not None:
+                return attr_config_t2q(attr_config_dict2t(cfg_dict))
+        except Exception:
+            log.debug("Failed to load stored config of %s/%s", self.name,
+                      attr_name, exc_info=1)
+
+    def __new_attribute_config(self, attr_name):
+        """creates the config cache entry for an attribute. If the persistent
+        config cache knows the attribute the entry is already filled.
+        Must be called with the lock held"""
+        attr_cfg = futures.Future()
+        stored_cfg = self.__stored_attribute_config(attr_name)
+        if stored_cfg is not None:
+            attr_cfg.set_running_or_notify_cancel()
+            attr_cfg.set_result(stored_cfg)
+        self.__attr_config_cache[attr_name] = attr_cfg
+        return attr_cfg
+
+    def __revalidate_attribute_config(self, attr_name):
+        attr_cfg = self.__read_attribute_config(attr_name)
+        self._set_attribute_config_cache(attr_name, attr_cfg)
+        return attr_cfg
+
+    def __attribute_config(self, attr_name):
+        """returns the AttributeConfig (blocking)"""
+        return self.__attribute_configs((attr_name,))[0]
+
+    def __attribute_configs(self, attr_names):
+        """returns the list of AttributeConfig of the given (lower case)
+        attributes (blocking).
+
+        The config cache holds one future per attribute. A pending future
+        is claimed (set to running) by the first thread which needs the
+        value and that thread does the fetch, so concurrent requests share
+        a single get_attribute_config_ex and nobody waits on a fetch which
+        is still queued in the executor. All the configs claimed by a call
+        are fetched in a single get_attribute_config_ex. A failed fetch is
+        dropped from the cache so that the next request retries it."""
+        attr_cfgs, claimed, revalidate = [], {}, []
+        with self.__lock:
+            for attr_name in attr_names:
+                attr_cfg = self.__attr_config_cache.get(attr_name)
+                if attr_cfg is None or attr_cfg.cancelled():
+                    attr_cfg = self.__new_attribute_config(attr_name)
+                    if attr_cfg.done():
+                        revalidate.append(attr_name)
+                if not (attr_cfg.running() or attr_cfg.done()):
+                    attr_cfg.set_running_or_notify_cancel()
+                    claimed[attr_name] = attr_cfg
+                attr_cfgs.append(attr_cfg)
+        for attr_name in revalidate:
+            self._submit(self.__revalidate_attribute_config, attr_name)
+        if claimed:
+            claimed_names = list(claimed)
+            try:
+                tango_cfgs = self.hw_device.get_attribute_config_ex(
+                    claimed_names)
+                results = self.__update_attribute_configs(
+                    list(zip(claimed_names, tango_cfgs)))
+            except Exception:
+                self.__drop_attribute_configs(claimed, sys.exc_info()[1])
+            else:
+                for attr_name, attr_cfg in zip(claimed_names, results):
+                    claimed[attr_name].set_result(attr_cfg)
+        return [attr_cfg.result() for attr_cfg in attr_cfgs]
+
+    def __drop_attribute_configs(self, claimed, exc):
+        """fails the claimed config futures (dict<attr name, Future>) and
+        removes them from the cache"""
+        with self.__lock:
+            for attr_name, attr_cfg in claimed.items():
+                if self.__attr_config_cache.get(attr_name) is attr_cfg:
+                    del self.__attr_config_cache[attr_name]
+        for attr_cfg in claimed.values():
+            attr_cfg.set_exception(exc)
+
+    def __claim_attribute_configs(self, attr_names):
+        """claims (sets to running) the config cache entries of the given
+        attributes which nobody is fetching yet. Returns dict<attr name,
+        claimed Future>"""
+        claimed = {}
+        with self.__lock:
+            for attr_name in attr_names:
+                attr_cfg = self.__attr_config_cache.get(attr_name)
+                if attr_cfg is None or attr_cfg.cancelled():
+                    attr_cfg = futures.Future()
+                    self.__attr_config_cache[attr_name] = attr_cfg
+                if attr_cfg.running() or attr_cfg.done():
+                    continue
+                attr_cfg.set_running_or_notify_cancel()
+                claimed[attr_name] = attr_cfg
+        return claimed
+
+    def __prefetch_attribute_configs(self, attr_names):
+        # claimed here, in the worker, so that concurrent waiters of these
+        # configs share the prefetch instead of waiting on a queued task
+        claimed = {}
+        if attr_names is not None:
+            claimed = self.__claim_attribute_configs(attr_names)
+        try:
+            if attr_names is None:
+                tango_cfgs = self.hw_device.attribute_list_query_ex()
+                attr_names = [tango_cfg.name for tango_cfg in tango_cfgs]
+            else:
+                tango_cfgs = self.hw_device.get_attribute_config_ex(attr_names)
+            attr_cfgs = self.__update_attribute_configs(list(zip(attr_names,
+                                                                 tango_cfgs)))
+        except Exception:
+            self.__drop_attribute_configs(claimed, sys.exc_info()[1])
+            raise
+        result = {}
+        with self.__lock:
+            for attr_name, attr_cfg in zip(attr_names, attr_cfgs):
+                attr_name = attr_name.lower()
+                result[attr_name] = attr_cfg
+                attr_cfg_f = claimed.pop(attr_name, None)
+                if attr_cfg_f is None:
+                    # not claimed: either unknown or fetched by someone else
+                    attr_cfg_f = self.__attr_config_cache.get(attr_name)
+                    if attr_cfg_f is None or attr_cfg_f.done():
+                        self._set_attribute_config_cache(attr_name, attr_cfg)
+                        continue
+                    if attr_cfg_f.running() or \
+                       not attr_cfg_f.set_running_or_notify_cancel():
+                        continue
+                attr_cfg_f.set_result(attr_cfg)
+        for attr_cfg_f in claimed.values():
+            attr_cfg_f.set_exception(KeyError("attribute config not received"))
+        return result
+
+    def prefetch_attribute_configs(self, attr_names=None):
+        """fetches the configuration of several attributes in a single round
+        trip (get_attribute_config_ex) and fills the config cache (and the
+        persistent config cache, if enabled). Panels can call it while they
+        are built so that rendering doesn't wait for configs one by one.
+
+        :param attr_names: sequence of attribute names [default: None,
+                           meaning all attributes of the device
+                           (attribute_list_query_ex)]
+        :return: a Future of dict<attr name (lower case), AttributeConfig>"""
+        if attr_names is not None:
+            attr_names = [attr_name.lower() for attr_name in attr_names]
+        return self._submit(self.__prefetch_attribute_configs, attr_names)
+
     def __run_command(self, cmd_name, *args, **kwargs):
-        result = self.command_inout(cmd_name, *args, **kwargs)
+        result = self.hw_device.command_inout(cmd_name, *args, **kwargs)
         return result
 
+    def __run_command_asynch(self, future, cmd_name, args):
+        callback = _AsynchCallback(partial(_set_future, future))
+        self.hw_device.command_inout_asynch(cmd_name, *(args + (callback,)))
+
     def _set_attribute_value_cache(self, attr_name, value):
+        attr_name = attr_name.lower()
         if isinstance(value, futures.Future):
             value_f = value
         else:
             value_f = futures.Future()
             value_f.set_result(value)
         self.__attr_value_cache[attr_name] = value_f
+        self.__attr_value_stamp[attr_name] = time.time()
 
     def _set_attribute_config_cache(self, attr_name, config):
+        attr_name = attr_name.lower()
         if isinstance(config, futures.Future):
             config_f = config
         else:
             config_f = futures.Future()
             config_f.set_result(config)
-        self.__attr_config_cache[attr_name] = config_f
+        with self.__lock:
+            self.__attr_config_cache[attr_name] = config_f
                                 
     def get_state(self):
-        return submit(self.hw_device.state)
+        if _asynch_io():
+            return self.run_command("State")
+        return self._submit(self.hw_device.state)
 
     def read_attribute(self, attr_name):
-        """returns a Future of AttributeValue"""
-        attr_value = submit(self.__read_attribute_value, attr_name)
+        """returns a Future of AttributeValue
+
+        Reads of this device arriving within
+        :data:`qarbon.config.TANGO_READ_BATCH_WINDOW` seconds are merged
+        into a single read_attributes round trip"""
+        attr_name = attr_name.lower()
+        if self.__read_batcher.window > 0:
+            attr_value = futures.Future()
+            self.__read_batcher.add(attr_name, partial(_append, attr_value))
+        elif _asynch_io():
+            attr_value = futures.Future()
+            self.__read_batch({attr_name: [attr_value]})
+        else:
+            attr_value = self._submit(self.__read_attribute_value, attr_name)
         self._set_attribute_value_cache(attr_name, attr_value)
         return attr_value
 
+    def read_attributes(self, attr_names):
+        """reads several attributes in a single round trip.
+
+        :param attr_names: sequence of attribute names
+        :return: dict<attr name, Future of AttributeValue>"""
+        result, batch = {}, {}
+        for attr_name in attr_names:
+            attr_name_lower = attr_name.lower()
+            attr_value = futures.Future()
+            self._set_attribute_value_cache(attr_name_lower, attr_value)
+            batch.setdefault(attr_name_lower, []).append(attr_value)
+            result[attr_name] = attr_value
+        if batch:
+            self.__read_batch(batch)
+        return result
+
+    def write_attribute(self, attr_name, value):
+        """writes an attribute. Quantities are converted to the attribute
+        unit.
+
+        Writes of this device arriving within
+        :data:`qarbon.config.TANGO_WRITE_BATCH_WINDOW` seconds are merged
+        into a single write_attributes round trip. If an attribute is
+        written several times in the window only the last value is sent.
+        Writes are applied in order: while a write is in flight the next
+        ones wait (merged) for it to complete.
+
+        :return: a Future which is done when the value is applied (the
+                 futures of replaced values are done at the same time)"""
+        attr_name = attr_name.lower()
+        future = futures.Future()
+        self.__write_batcher.add(attr_name, partial(_replace, value, future))
+        return future
+
     def get_attribute_config(self, attr_name):
-        """returns a Future of AttributeConfig"""        
+        """returns a Future of AttributeConfig
+
+        The config is fetched once and then kept until an ATTR_CONF_EVENT
+        replaces it. If the persistent config cache is enabled
+        (:data:`qarbon.config.TANGO_CONFIG_CACHE`) a stored config is used
+        immediately and revalidated in the background"""
         attr_name = attr_name.lower()
-        attr_cfg = self.__attr_config_cache.get(attr_name)
-        if attr_cfg is None:
-            attr_cfg = submit(self.__read_attribute_config, attr_name)
-            self._set_attribute_config_cache(attr_name, attr_cfg)
+        with self.__lock:
+            attr_cfg = self.__attr_config_cache.get(attr_name)
+            new = attr_cfg is None or attr_cfg.cancelled()
+            if new:
+                attr_cfg = self.__new_attribute_config(attr_name)
+        if new:
+            if attr_cfg.done():
+                self._submit(self.__revalidate_attribute_config, attr_name)
+            else:
+                self._submit(self.__attribute_config, attr_name)
         return attr_cfg
 
-    def get_attribute_value(self, attr_name):
+    def __is_fresh(self, attr_name, attr_value, max_age):
+        if attr_value is None:
+            return False
+        if max_age is None or not attr_value.done():
+            # a pending read is the freshest value there will be
+            return True
+        age = time.time() - self.__attr_value_stamp.get(attr_name, 0.0)
+        return age <= max_age
+
+    def get_attribute_value(self, attr_name, max_age=None):
+        """returns a Future of the cached AttributeValue.
+
+        :param max_age: maximum age (seconds) of the cached value (the age
+                        counts from when the value was requested or received
+                        by event). An older value is refreshed with a single
+                        read shared by all concurrent callers
+                        [default: None, meaning any age]"""
         attr_name = attr_name.lower()
         attr_value = self.__attr_value_cache.get(attr_name)
-        if attr_value is None:
-            attr_value = self.read_attribute(attr_name)
-            self._set_attribute_value_cache(attr_name, attr_value)
-        return attr_value
+        if self.__is_fresh(attr_name, attr_value, max_age):
+            return self.__or_stale(attr_name, attr_value)
+        with self.__lock:
+            attr_value = self.__attr_value_cache.get(attr_name)
+            if not self.__is_fresh(attr_name, attr_value, max_age):
+                attr_value = self.read_attribute(attr_name)
+        return self.__or_stale(attr_name, attr_value)
+
+    def __or_stale(self, attr_name, attr_value):
+        """returns the last known value (see
+        :data:`qarbon.config.TANGO_SNAPSHOT`) while the live value is not
+        available yet"""
+        if attr_value.done():
+            self.__stale_values.pop(attr_name, None)
+            return attr_value
+        snapshot = _snapshot()
+        if snapshot is None:
+            return attr_value
+        stale_value = self.__stale_values.get(attr_name)
+        if stale_value is None:
+            stale_value = self.__load_stale_value(snapshot, attr_name)
+            self.__stale_values[attr_name] = stale_value
+        return stale_value or attr_value
+
+    def __load_stale_value(self, snapshot, attr_name):
+        """returns a done future of the last known value or False"""
+        try:
+            value_dict = snapshot.get(self.__full_name(attr_name))
+            if value_dict is None:
+                return False
+            attr_cfg = self.__attr_config_cache.get(attr_name)
+            if attr_cfg is not None and attr_cfg.done() and \
+               attr_cfg.exception() is None:
+                attr_cfg = attr_cfg.result()
+            else:
+                attr_cfg = None
+            stale_value = futures.Future()
+            stale_value.set_result(attr_value_dict2q(value_dict, attr_cfg))
+            return stale_value
+        except Exception:
+            log.debug("Failed to load last known value of %s/%s", self.name,
+                      attr_name, exc_info=1)
+            return False
+
+    def _snapshot_items(self):
+        """returns the current scalar values as a list of (full attribute
+        name, value dict) (see :func:`attr_value_q2dict`). Spectrum and image
+        values are not saved: pickling them on every save would cost more
+        than what they are worth as a placeholder"""
+        items = []
+        for attr_name, attr_value in list(self.__attr_value_cache.items()):
+            if not attr_value.done() or attr_value.exception() is not None:
+                continue
+            attr_value = attr_value.result()
+            if attr_value is None or attr_value.error or \
+               attr_value.stale or attr_value.r_ndim:
+                continue
+            try:
+                items.append((self.__full_name(attr_name),
+                              attr_value_q2dict(attr_value)))
+            except Exception:
+                log.debug("Failed to save value of %s/%s", self.name,
+                          attr_name, exc_info=1)
+        return items
 
     def run_command(self, cmd_name, *args, **kwargs):
-        return submit(self.__run_command,  cmd_name, *args, **kwargs)        
+        """runs a command and returns a Future of its result. Keyword
+        arguments are passed to command_inout; they are not supported in
+        asynchronous I/O mode (TypeError)"""
+        if _asynch_io():
+            if kwargs:
+                raise TypeError("run_command() keyword arguments are not "
+                                "supported in asynch I/O mode: {0}".format(
+                                    ", ".join(sorted(kwargs))))
+            future = futures.Future()
+            send_future = self._submit(self.__run_command_asynch, future,
+                                       cmd_name, args)
+            on_error = lambda exc: _set_future(future, exc=exc)
+            send_future.add_done_callback(partial(_check_sent, on_error))
+            return future
+        return self._submit(self.__run_command,  cmd_name, *args, **kwargs)
 
     def __getattr__(self, name):
-        return getattr(self.__device, name)
+        return getattr(self.hw_device, name)
+
+
+def _value_changed(old_value, new_value):
+    """tells if the new AttributeValue differs (value or quality) from the
+    old one"""
+    if old_value is None or old_value.r_quality != new_value.r_quality:
+        return True
+    try:
+        diff = old_value.r_magnitude != new_value.r_magnitude
+        return bool(diff.any() if hasattr(diff, "any") else diff)
+    except Exception:
+        return True
+
+
+def _in_deadband(old_value, new_value, abs_change=None, rel_change=None):
+    """tells if the change between two AttributeValues is too small to be
+    notified. Changes are compared on magnitudes (for arrays, the largest
+    element change is used). A quality change is never in the deadband"""
+    if abs_change is None and rel_change is None:
+        return False
+    if old_value is None or old_value.r_quality != new_value.r_quality:
+        return False
+    try:
+        old, new = old_value.r_magnitude, new_value.r_magnitude
+        delta, ref = abs(new - old), abs(old)
+        if hasattr(delta, "max"):
+            delta, ref = delta.max(), ref.max()
+    except Exception:
+        return False
+    if abs_change is not None and delta >= abs_change:
+        return False
+    if rel_change is not None and delta >= rel_change * ref:
+        return False
+    return True
+
+
+class Poller(object):
+    """Central polling scheduler for attributes which can't rely on events.
+
+    Attributes register a polling period. Attributes sharing a period are
+    kept in the same slot; a single thread wakes up when the next slot is
+    due and reads all its attributes grouped per device (one
+    read_attributes call per device). Attributes are kept with weak
+    references."""
+
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__slots = {}  # period -> Dict<id, Attribute>
+        self.__schedule = []  # heap of (due time, period)
+        self.__thread = None
+
+    def register(self, attribute, period):
+        """polls the given attribute every *period* seconds"""
+        with self.__cond:
+            self.__unregister(attribute)
+            slot = self.__slots.get(period)
+            if slot is None:
+                slot = self.__slots[period] = Dict()
+                heapq.heappush(self.__schedule, (time.time() + period, period))
+                self.__cond.notify()
+            slot[id(attribute)] = attribute
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run,
+                                                 name="qarbon.tango.Poller")
+                self.__thread.daemon = True
+                self.__thread.start()
+
+    def unregister(self, attribute):
+        """stops polling the given attribute"""
+        with self.__cond:
+            self.__unregister(attribute)
+
+    def __unregister(self, attribute):
+        for slot in self.__slots.values():
+            slot.pop(id(attribute), None)
+
+    def __next_due(self):
+        """waits for the next due slot and returns its attributes"""
+        with self.__cond:
+            while True:
+                if not self.__schedule:
+                    self.__cond.wait()
+                    continue
+                due, period = self.__schedule[0]
+                now = time.time()
+                if due > now:
+                    self.__cond.wait(due - now)
+                    continue
+                heapq.heappop(self.__schedule)
+                attributes = list(self.__slots[period].values())
+                if not attributes:
+                    del self.__slots[period]
+                    continue
+                # skip missed ticks instead of bursting to catch up
+                due = max(due + period, now)
+                heapq.heappush(self.__schedule, (due, period))
+                return attributes
+
+    def __run(self):
+        while True:
+            attributes = self.__next_due()
+            try:
+                self.__poll(attributes)
+            except Exception:
+                log.exception("Error polling attributes")
+
+    def __poll(self, attributes):
+        per_device = {}
+        for attribute in attributes:
+            per_device.setdefault(attribute.device, []).append(attribute)
+        for device, attributes in per_device.items():
+            attr_values = device.read_attributes([attribute.name
+                                                  for attribute in attributes])
+            for attribute in attributes:
+                attr_value = attr_values[attribute.name]
+                attr_value.add_done_callback(attribute._on_poll)
+
+
+__POLLER = None
+__POLLER_LOCK = threading.Lock()
+def poller():
+    """returns the :class:`Poller` of the tango plugin"""
+    global __POLLER
+    with __POLLER_LOCK:
+        if __POLLER is None:
+            __POLLER = Poller()
+    return __POLLER
+
+
+class _WeakMethod(object):
+    """Callable holding a weak reference to a bound method, so that event
+    subscriptions don't keep their Attribute alive"""
+
+    def __init__(self, method):
+        self.__obj = ref(method.__self__)
+        self.__func = method.__func__
+
+    def __call__(self, *args, **kwargs):
+        obj = self.__obj()
+        if obj is not None:
+            return self.__func(obj, *args, **kwargs)
+
+
+class _Unsubscriber(object):
+    """Background event unsubscription. Finalizers only put the pending
+    subscriptions in a queue (SimpleQueue.put is safe in __del__: no
+    network, no lock which the collected object could hold); a daemon
+    thread waits on the queue, drains it and unsubscribes with one executor
+    task per device"""
+
+    def __init__(self):
+        self.__pending = _SimpleQueue()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name="qarbon.tango.Unsubscriber")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def add(self, device, evt_ids_future):
+        """schedules the unsubscription of a Future of event ids. Safe to
+        call from __del__"""
+        self.__pending.put((device, evt_ids_future))
+
+    def __run(self):
+        pending = self.__pending
+        while True:
+            device, evt_ids_future = pending.get()
+            per_device = {device: [evt_ids_future]}
+            while True:
+                try:
+                    device, evt_ids_future = pending.get_nowait()
+                except queue.Empty:
+                    break
+                per_device.setdefault(device, []).append(evt_ids_future)
+            for device, evt_ids_futures in per_device.items():
+                try:
+                    device._submit(self.__unsubscribe, device, evt_ids_futures)
+                except Exception:
+                    log.debug("Failed to unsubscribe from %s", device,
+                              exc_info=1)
+
+    @staticmethod
+    def __unsubscribe(device, evt_ids_futures):
+        hw_device = device.hw_device
+        for evt_ids_future in evt_ids_futures:
+            try:
+                evt_ids = evt_ids_future.result()
+            except Exception:
+                # subscription failed: nothing to undo
+                continue
+            for evt_id in evt_ids:
+                try:
+                    hw_device.unsubscribe_event(evt_id)
+                except Exception:
+                    log.debug("Failed to unsubscribe event %s from %s",
+                              evt_id, device, exc_info=1)
+
+
+__UNSUBSCRIBER = None
+__UNSUBSCRIBER_LOCK = threading.Lock()
+def unsubscriber():
+    """returns the :class:`_Unsubscriber` of the tango plugin"""
+    global __UNSUBSCRIBER
+    with __UNSUBSCRIBER_LOCK:
+        if __UNSUBSCRIBER is None:
+            __UNSUBSCRIBER = _Unsubscriber()
+    return __UNSUBSCRIBER
 
 
 class Attribute(_Attribute):
@@ -288,37 +1582,225 @@ class Attribute(_Attribute):
 
     def __init__(self, device, name):
         _Attribute.__init__(self, device, name)
+        self.__poll_period = None
+        self.__poll_fallback = False
+        self.__last_polled = None
+        self.__notify_lock = threading.Lock()
+        self.__max_rate = config.TANGO_EVENT_MAX_RATE
+        self.__abs_change = None
+        self.__rel_change = None
+        self.__last_notified = None
+        self.__last_notify_time = 0.0
+        self.__notify_timer = None
+        self.__history = None
+        self.__event_lock = threading.Lock()
+        self.__pending_event = None
+        # created now: __del__ must not create threads nor take locks
+        self.__unsubscriber = unsubscriber()
         self.__evt_ids_future = submit(self.__init_future)
 
     def __init_future(self):
         dev = self.device.hw_device
+        # weak callbacks: the subscriptions must not keep this object alive
+        # (otherwise it is never collected and never unsubscribed)
+        on_config = _WeakMethod(self.__onConfigEvent)
+        on_change = _WeakMethod(self.__onChangeEvent)
         evt_type = Tango.EventType.ATTR_CONF_EVENT
         try:
-            cfg_evt_id = dev.subscribe_event(self.name, evt_type, self.__onConfigEvent)
+            cfg_evt_id = dev.subscribe_event(self.name, evt_type, on_config)
         except Tango.DevFailed:
-            cfg_evt_id = dev.subscribe_event(self.name, evt_type, self.__onConfigEvent, [], True)
-            
+            cfg_evt_id = dev.subscribe_event(self.name, evt_type, on_config,
+                                             [], True)
+
         evt_type = Tango.EventType.CHANGE_EVENT
         try:
-            ch_evt_id = dev.subscribe_event(self.name, evt_type, self.__onChangeEvent)
+            ch_evt_id = dev.subscribe_event(self.name, evt_type, on_change,
+                                            [], False, extract_as=_NUMPY)
         except Tango.DevFailed:
-            ch_evt_id = dev.subscribe_event(self.name, evt_type, self.__onChangeEvent, [], True)
+            # no events (for now): keep the value fresh by polling until
+            # the stateless subscription delivers a real event
+            if self.__poll_period is None and config.TANGO_POLL_PERIOD:
+                self.__poll_fallback = True
+                self.set_polling_period(config.TANGO_POLL_PERIOD)
+            ch_evt_id = dev.subscribe_event(self.name, evt_type, on_change,
+                                            [], True, extract_as=_NUMPY)
         return cfg_evt_id, ch_evt_id
 
     def __del__(self):
-        for evt_id in self.__evt_ids_future.result():
-            self.device.hw_device.unsubscribe_event(evt_id)
-        
+        # never block the thread running the garbage collector (often the
+        # GUI thread): unsubscribe in the background
+        self.__unsubscriber.add(self.device, self.__evt_ids_future)
+
     @log.debug_it
     def __onChangeEvent(self, event_data):
-        attr_cfg_future = self.device.get_attribute_config(self.name)
         if event_data.err:
             log.error("error change event")
-        else:
+            return
+        if self.__poll_fallback:
+            # events are working: polling is not needed anymore
+            self.__poll_fallback = False
+            self.set_polling_period(None)
+        # never block the tango event thread waiting for the config: the
+        # latest event arriving before it (or while a buffered one is being
+        # converted) is buffered and converted once the config is available
+        attr_cfg_future = self.device.get_attribute_config(self.name)
+        with self.__event_lock:
+            buffered = self.__pending_event is not None or \
+                not attr_cfg_future.done()
+            if buffered:
+                wait = self.__pending_event is None
+                self.__pending_event = event_data.attr_value
+        if not buffered:
+            self.__on_value(attr_cfg_future, event_data.attr_value)
+        elif wait:
+            attr_cfg_future.add_done_callback(self.__drain_events)
+
+    def __drain_events(self, attr_cfg_future):
+        """converts the buffered event (called when the config future is
+        done). If the config could not be fetched the event is dropped: the
+        next event fetches the config again"""
+        if attr_cfg_future.cancelled() or \
+           attr_cfg_future.exception() is not None:
+            with self.__event_lock:
+                self.__pending_event = None
+            log.warning("Dropped change event of %s: no config", self)
+            return
+        attr_cfg_future = self.device.get_attribute_config(self.name)
+        if not attr_cfg_future.done():
+            # config replaced meanwhile: wait for the new one
+            attr_cfg_future.add_done_callback(self.__drain_events)
+            return
+        while True:
+            with self.__event_lock:
+                tango_attr_value = self.__pending_event
+            if tango_attr_value is None:
+                return
+            self.__on_value(attr_cfg_future, tango_attr_value)
+            with self.__event_lock:
+                # events which arrived meanwhile replaced the converted one
+                if self.__pending_event is tango_attr_value:
+                    self.__pending_event = None
+                    return
+
+    def __on_value(self, attr_cfg_future, tango_attr_value):
+        try:
             attr_value = attr_value_t2q(attr_cfg_future.result(),
-                                        event_data.attr_value)
-            self.device._set_attribute_value_cache(self.name, attr_value)
-            self.valueChanged.emit()
+                                        tango_attr_value)
+        except Exception:
+            log.error("Failed to convert change event of %s", self,
+                      exc_info=1)
+            return
+        self.device._set_attribute_value_cache(self.name, attr_value)
+        self.__record(attr_value)
+        self.__notify(attr_value)
+
+    def set_event_policy(self, max_rate=None, abs_change=None,
+                         rel_change=None):
+        """Limits the rate of valueChanged notifications. Listeners always
+        get the latest value (:meth:`get_value`); intermediate values are
+        conflated.
+
+        :param max_rate: maximum notification rate (Hz). Values arriving
+                         faster are conflated and the latest one is
+                         notified at the end of the period (trailing edge)
+                         [default: None, meaning no limit]
+        :param abs_change: minimum absolute change (in attribute units) of
+                           the value to be notified [default: None]
+        :param rel_change: minimum relative change (ex: 0.01 for 1%) of the
+                           value to be notified [default: None]"""
+        with self.__notify_lock:
+            self.__max_rate = max_rate
+            self.__abs_change = abs_change
+            self.__rel_change = rel_change
+
+    def get_event_policy(self):
+        """returns the current event policy as a tuple (max_rate,
+        abs_change, rel_change)"""
+        return self.__max_rate, self.__abs_change, self.__rel_change
+
+    def __notify(self, attr_value):
+        """emits valueChanged according to the event policy"""
+        with self.__notify_lock:
+            if _in_deadband(self.__last_notified, attr_value,
+                            self.__abs_change, self.__rel_change):
+                return
+            self.__last_notified = attr_value
+            if self.__notify_timer is not None:
+                # a trailing notification is already scheduled
+                return
+            now = time.time()
+            if self.__max_rate:
+                wait = self.__last_notify_time + 1.0 / self.__max_rate - now
+                if wait > 0:
+                    # emitted from an executor thread: slots may wait for
+                    # reads, which are flushed by the scheduler thread
+                    self.__notify_timer = scheduler().call_later(
+                        wait, submit, _WeakMethod(self.__flush_notify))
+                    return
+            self.__last_notify_time = now
+        self.valueChanged.emit()
+
+    def __flush_notify(self):
+        with self.__notify_lock:
+            self.__notify_timer = None
+            self.__last_notify_time = time.time()
+        self.valueChanged.emit()
+
+    def _on_poll(self, attr_value_future):
+        """called by the :class:`Poller` with the result of a read"""
+        try:
+            attr_value = attr_value_future.result()
+        except Exception:
+            log.debug("Failed to poll %s", self, exc_info=1)
+            return
+        changed = _value_changed(self.__last_polled, attr_value)
+        self.__last_polled = attr_value
+        if changed:
+            self.__record(attr_value)
+            self.__notify(attr_value)
+
+    def enable_history(self, capacity, shape=(), dtype=float):
+        """keeps the last *capacity* received values in a
+        :class:`~qarbon.history.History` (memory is allocated once, whatever
+        the event rate).
+
+        :param capacity: maximum number of values kept
+        :param shape: shape of each value (ex: (1024,) for a spectrum)
+        :param dtype: numpy dtype of the values
+        :return: the History"""
+        from qarbon.history import History
+        self.__history = History(capacity, shape=shape, dtype=dtype)
+        return self.__history
+
+    def disable_history(self):
+        self.__history = None
+
+    def get_history(self):
+        """returns the :class:`~qarbon.history.History` or None if history
+        is not enabled"""
+        return self.__history
+
+    def __record(self, attr_value):
+        history = self.__history
+        if history is not None:
+            try:
+                history.append(attr_value)
+            except Exception:
+                log.debug("Failed to record history of %s", self, exc_info=1)
+
+    def set_polling_period(self, period):
+        """polls this attribute every *period* seconds (through the central
+        :class:`Poller`). valueChanged is only emitted when the value (or
+        quality) changes. None stops polling"""
+        self.__poll_period = period
+        if period is None:
+            self.__last_polled = None
+            poller().unregister(self)
+        else:
+            poller().register(self, period)
+
+    def get_polling_period(self):
+        return self.__poll_period
 
     @log.debug_it
     def __onConfigEvent(self, event_data):
@@ -326,41 +1808,169 @@ class Attribute(_Attribute):
             log.error("error config event")
         else:
             attr_value_future = self.device.get_attribute_value(self.name)
-            attr_config = attr_config_t2q(event_data.attr_conf)
+            attr_config = self.device._update_attribute_config(
+                self.name, event_data.attr_conf)
             self.device._set_attribute_config_cache(self.name, attr_config)
-            attr_value_future.result().config = attr_config
-            self.valueChanged.emit()
+            # don't block the event thread if the value is still being read
+            attr_value_future.add_done_callback(partial(self.__set_config,
+                                                        attr_config))
+
+    def __set_config(self, attr_config, attr_value_future):
+        if attr_value_future.cancelled() or \
+           attr_value_future.exception() is not None:
+            return
+        attr_value = attr_value_future.result()
+        if attr_value is not None:
+            attr_value.config = attr_config
+        self.valueChanged.emit()
 
     def read(self):
         return self.device.read_attribute(self.name)
 
     def write(self, value):
-        pass
+        """writes the attribute (see :meth:`Device.write_attribute`)
+
+        :return: a Future which is done when the value is applied"""
+        return self.device.write_attribute(self.name, value)
 
-    def get_value(self):
-        return self.device.get_attribute_value(self.name)
+    def get_value(self, max_age=None):
+        """returns a Future of the AttributeValue (see
+        :meth:`Device.get_attribute_value`)"""
+        return self.device.get_attribute_value(self.name, max_age=max_age)
 
 
 class Factory(_Factory):
 
     def __init__(self):
         _Factory.__init__(self)
+        self.__lock = threading.Lock()
         self.__devices = Dict() 
+        self.__attributes = Dict()
     
     @log.debug_it
     def get_device(self, name):
         name_lower = name.lower()
-        device = self.__devices.get(name_lower)
-        if device is None:
-            device = Device(name)         
-            self.__devices[name_lower] = device
+        with self.__lock:
+            device = self.__devices.get(name_lower)
+            if device is None:
+                device = Device(name)         
+                self.__devices[name_lower] = device
         return device
 
     @log.debug_it
     def get_attribute(self, name):
-        dev_name, name = name.rsplit("/", 1)
+        """returns the Attribute for the given full name. The same object
+        (and therefore the same event subscriptions) is shared by all users
+        of the attribute while it is alive"""
+        dev_name, attr_name = name.rsplit("/", 1)
+        name_lower = "{0}/{1}".format(dev_name.lower(), attr_name.lower())
         device = self.get_device(dev_name)
-        return Attribute(device, name)       
+        with self.__lock:
+            attribute = self.__attributes.get(name_lower)
+            if attribute is None:
+                attribute = Attribute(device, attr_name)
+                self.__attributes[name_lower] = attribute
+        return attribute
+
+    def __device_names(self, dev_pattern):
+        if not is_pattern(dev_pattern):
+            return [dev_pattern]
+        db_pattern = _star_pattern(dev_pattern)
+        fetch = lambda: list(db_cache().database.get_device_exported(
+            db_pattern))
+        dev_names = db_cache().get("devices:" + db_pattern.lower(), fetch)
+        dev_pattern = dev_pattern.lower()
+        return [dev_name for dev_name in dev_names
+                if fnmatch.fnmatchcase(dev_name.lower(), dev_pattern)]
+
+    def __attribute_names(self, dev_name):
+        device = self.get_device(dev_name)
+        fetch = lambda: list(device.hw_device.get_attribute_list())
+        return db_cache().get("attributes:" + dev_name.lower(), fetch)
+
+    def __attribute_lists(self, dev_names):
+        """returns the attribute lists of the given devices, fetched in
+        parallel. Devices which fail or don't answer within
+        :data:`qarbon.config.TANGO_EXPAND_TIMEOUT` seconds give an empty
+        list"""
+        fs = [self.get_device(dev_name)._submit(self.__attribute_names,
+                                                 dev_name)
+              for dev_name in dev_names]
+        futures.wait(fs, timeout=config.TANGO_EXPAND_TIMEOUT)
+        result = []
+        for dev_name, attr_names in zip(dev_names, fs):
+            if not attr_names.done():
+                attr_names.cancel()
+                log.warning("Timeout getting attribute list of %s", dev_name)
+                result.append([])
+            elif attr_names.cancelled() or \
+                 attr_names.exception() is not None:
+                log.warning("Failed to get attribute list of %s", dev_name)
+                if not attr_names.cancelled():
+                    log.debug("Details: %s", attr_names.exception())
+                result.append([])
+            else:
+                result.append(attr_names.result())
+        return result
+
+    @log.debug_it
+    def expand(self, pattern):
+        """expands a wildcard attribute name (ex: 'sr/ps-*/*/current') into
+        the list of matching full attribute names. Devices are matched with
+        a single database query (exported devices only; ? and [] are
+        matched locally since the database only understands *) and the
+        attribute lists of all matched devices are fetched in parallel
+        (waiting at most :data:`qarbon.config.TANGO_EXPAND_TIMEOUT`
+        seconds). Results are cached (see
+        :data:`qarbon.config.TANGO_DB_CACHE_TTL`).
+
+        :param pattern: full attribute name which may contain wildcards
+                        (*, ? and []) in the device and/or attribute part
+        :return: list of full attribute names"""
+        dev_pattern, attr_pattern = pattern.rsplit("/", 1)
+        dev_names = self.__device_names(dev_pattern)
+        if not is_pattern(attr_pattern):
+            return ["{0}/{1}".format(dev_name, attr_pattern)
+                    for dev_name in dev_names]
+        attr_pattern = attr_pattern.lower()
+        result = []
+        attr_lists = self.__attribute_lists(dev_names)
+        for dev_name, attr_names in zip(dev_names, attr_lists):
+            result.extend("{0}/{1}".format(dev_name, attr_name)
+                          for attr_name in attr_names
+                          if fnmatch.fnmatchcase(attr_name.lower(),
+                                                 attr_pattern))
+        return result
+
+    def get_attributes(self, pattern):
+        """returns the Attributes matching a wildcard name (see
+        :meth:`expand`). Their event subscriptions are started in parallel
+
+        :return: list of Attribute"""
+        return [self.get_attribute(name) for name in self.expand(pattern)]
+
+    @log.debug_it
+    def read_attributes(self, names):
+        """reads many attributes (possibly from many devices) in parallel.
+        One asynchronous request is sent to each device and the replies are
+        pushed to callbacks: no thread waits for a reply, so the total time
+        is that of the slowest device.
+
+        :param names: sequence of full attribute names
+        :return: dict<attr name, Future of AttributeValue>"""
+        result, group = {}, {}
+        for name in names:
+            dev_name, attr_name = name.rsplit("/", 1)
+            attr_name = attr_name.lower()
+            device = self.get_device(dev_name)
+            attr_value = futures.Future()
+            device._set_attribute_value_cache(attr_name, attr_value)
+            batch = group.setdefault(device, {})
+            batch.setdefault(attr_name, []).append(attr_value)
+            result[name] = attr_value
+        for device, batch in group.items():
+            device._read_batch_asynch(batch)
+        return result
 
 
 def main():
@@ -0,0 +1,104 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+"""Micro benchmarks of the tango plugin value conversion.
+
+Run with::
+
+    python -m qarbon.test.benchmark_tango [number of events]
+"""
+
+import sys
+import time
+
+import PyTango as Tango
+
+from qarbon.external.pint import Quantity
+from qarbon.core import AttributeValue, Quality
+from qarbon import tango
+
+
+def attr_value_t2q_uncompiled(attr_cfg, tango_attr_value):
+    """reference implementation: conversion without precompiled converter"""
+    dtype = tango_attr_value.type
+    fmt = attr_cfg.display_format
+    numerical = Tango.is_numerical_type(dtype)
+
+    r_value = tango_attr_value.value
+    w_value = tango_attr_value.w_value
+    units = attr_cfg.unit
+    if numerical:
+        if r_value is not None:
+            r_value = Quantity(r_value, units=units)
+            if fmt is not None:
+                r_value.default_format = fmt + r_value.default_format
+        if w_value is not None:
+            w_value = Quantity(w_value, units=units)
+            if fmt is not None:
+                w_value.default_format = fmt + w_value.default_format
+
+    quality = Quality(int(tango_attr_value.quality))
+    value = AttributeValue(r_value=r_value, r_quality=quality,
+                           r_timestamp=tango_attr_value.time.todatetime(),
+                           w_value=w_value, config=attr_cfg)
+    return value
+
+
+def build_config(dtype, unit="mm", fmt="%6.2f"):
+    cfg = dict(name="position", label="Position", description="",
+               format=fmt, unit=unit, display_unit="No display unit",
+               standard_unit="No standard unit", min_value="0",
+               max_value="100", min_alarm="Not specified",
+               max_alarm="Not specified", min_warning="Not specified",
+               max_warning="Not specified", data_type=int(dtype),
+               data_format=int(Tango.AttrDataFormat.SCALAR),
+               disp_level=int(Tango.DispLevel.OPERATOR),
+               writable=int(Tango.AttrWriteType.READ_WRITE))
+    return tango.attr_config_t2q(tango.attr_config_dict2t(cfg))
+
+
+def build_value(dtype, value):
+    result = Tango.DeviceAttribute()
+    result.name = "position"
+    result.type = dtype
+    result.value = value
+    result.w_value = value
+    result.quality = Tango.AttrQuality.ATTR_VALID
+    result.time = Tango.TimeVal.fromtimestamp(time.time())
+    result.has_failed = False
+    result.is_empty = False
+    return result
+
+
+def bench(convert, attr_cfg, tango_attr_value, n):
+    start = time.time()
+    for _ in range(n):
+        convert(attr_cfg, tango_attr_value)
+    return n / (time.time() - start)
+
+
+def main(n=100000):
+    cases = (("DevDouble", Tango.CmdArgType.DevDouble, 1.5),
+             ("DevLong", Tango.CmdArgType.DevLong, 3),
+             ("DevString", Tango.CmdArgType.DevString, "text"))
+    print("{0:<10} {1:>14} {2:>14} {3:>8}".format("type", "before (ev/s)",
+                                                  "after (ev/s)", "speedup"))
+    for name, dtype, value in cases:
+        attr_cfg = build_config(dtype)
+        tango_attr_value = build_value(dtype, value)
+        before = bench(attr_value_t2q_uncompiled, attr_cfg,
+                       tango_attr_value, n)
+        after = bench(tango.attr_value_t2q, attr_cfg, tango_attr_value, n)
+        print("{0:<10} {1:>14.0f} {2:>14.0f} {3:>7.2f}x".format(
+            name, before, after, after / before))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
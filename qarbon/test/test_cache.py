@@ -0,0 +1,77 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+from qarbon.cache import DiskCache
+
+
+class TestDiskCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "test.sqlite")
+        self.cache = DiskCache("test", filename=self.filename)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_set_get(self):
+        value = dict(unit="mm", range=[0.0, 10.0])
+        self.cache.set("sys/tg_test/1/double_scalar", value)
+        self.assertEqual(self.cache.get("sys/tg_test/1/double_scalar"),
+                         value)
+        self.assertTrue("sys/tg_test/1/double_scalar" in self.cache)
+        self.assertEqual(self.cache.get("unknown"), None)
+        self.assertEqual(self.cache.get("unknown", 5), 5)
+
+    def test_replace(self):
+        self.cache.set("a", 1)
+        self.cache.set("a", 2)
+        self.assertEqual(self.cache.get("a"), 2)
+        self.assertEqual(self.cache.keys(), ["a"])
+
+    def test_max_age(self):
+        self.cache.set("a", 1)
+        value, stamp = self.cache.get_item("a")
+        self.assertEqual(value, 1)
+        self.assertTrue(abs(time.time() - stamp) < 5)
+        time.sleep(0.05)
+        self.assertEqual(self.cache.get("a", max_age=10), 1)
+        self.assertEqual(self.cache.get("a", "old", max_age=0.01), "old")
+
+    def test_update(self):
+        items = [("attr/{0}".format(i), i) for i in range(100)]
+        self.cache.update(items)
+        self.assertEqual(sorted(self.cache.keys()),
+                         sorted(key for key, _ in items))
+        self.assertEqual(self.cache.get("attr/42"), 42)
+
+    def test_delete_clear(self):
+        self.cache.update([("a", 1), ("b", 2)])
+        self.cache.delete("a")
+        self.cache.delete("unknown")
+        self.assertFalse("a" in self.cache)
+        self.assertEqual(self.cache.keys(), ["b"])
+        self.cache.clear()
+        self.assertEqual(self.cache.keys(), [])
+
+    def test_persistence(self):
+        self.cache.set("a", [1, 2, 3])
+        self.cache.close()
+        self.cache = DiskCache("test", filename=self.filename)
+        self.assertEqual(self.cache.get("a"), [1, 2, 3])
+        self.assertEqual(self.cache.name, "test")
+        self.assertEqual(self.cache.filename, self.filename)
@@ -0,0 +1,213 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+import time
+import threading
+from unittest import TestCase
+
+from concurrent import futures
+
+from qarbon import executor
+
+
+def _square(x):
+    return x * x
+
+
+def _fail(x):
+    raise ValueError(x)
+
+
+def _blocked(event):
+    event.wait(5)
+
+
+def _counted(items, consumed):
+    """generator counting how many items were consumed"""
+    for item in items:
+        consumed.append(item)
+        yield item
+
+
+class TestSubmitMany(TestCase):
+
+    def test_submit_many(self):
+        calls = [(_square, (i,)) for i in range(10)]
+        fs = executor.submit_many(calls)
+        self.assertEqual([f.result(5) for f in fs],
+                         [i * i for i in range(10)])
+
+    def test_submit_many_chunks(self):
+        calls = [(_square, (i,)) for i in range(10)]
+        fs = executor.submit_many(calls, chunksize=3)
+        self.assertEqual(len(fs), 10)
+        self.assertEqual([f.result(5) for f in fs],
+                         [i * i for i in range(10)])
+
+    def test_submit_many_call_forms(self):
+        fs = executor.submit_many([lambda: 1, (_square, (3,)),
+                                   (int, ("11",), dict(base=2))])
+        self.assertEqual([f.result(5) for f in fs], [1, 9, 3])
+
+    def test_submit_many_errors(self):
+        calls = [(_square, (1,)), (_fail, (2,)), (_square, (3,))]
+        for chunksize in (1, 3):
+            fs = executor.submit_many(calls, chunksize=chunksize)
+            self.assertEqual(fs[0].result(5), 1)
+            self.assertRaises(ValueError, fs[1].result, 5)
+            self.assertEqual(fs[2].result(5), 9)
+
+
+class TestMap(TestCase):
+
+    def test_map(self):
+        self.assertEqual(list(executor.map(_square, range(20))),
+                         [i * i for i in range(20)])
+
+    def test_map_chunks(self):
+        result = executor.map(_square, range(20), chunksize=6)
+        self.assertEqual(list(result), [i * i for i in range(20)])
+
+    def test_map_window(self):
+        consumed = []
+        result = executor.map(_square, _counted(range(100), consumed),
+                              window=4)
+        # arguments are consumed lazily: only one window is in flight
+        self.assertEqual(len(consumed), 4)
+        self.assertEqual(next(result), 0)
+        self.assertEqual(len(consumed), 5)
+        self.assertEqual(list(result), [i * i for i in range(1, 100)])
+
+    def test_map_bad_option(self):
+        self.assertRaises(TypeError, executor.map, _square, range(3),
+                          windows=2)
+
+    def test_map_timeout(self):
+        result = executor.map(time.sleep, [0.5], timeout=0.05)
+        self.assertRaises(futures.TimeoutError, list, result)
+
+    def test_imap_unordered(self):
+        result = executor.imap_unordered(_square, range(20), chunksize=3)
+        self.assertEqual(sorted(result), [i * i for i in range(20)])
+
+    def test_imap_unordered_window(self):
+        consumed = []
+        result = executor.imap_unordered(_square,
+                                         _counted(range(50), consumed),
+                                         window=3)
+        self.assertEqual(len(consumed), 3)
+        self.assertEqual(sorted(result), [i * i for i in range(50)])
+
+    def test_imap_unordered_errors(self):
+        result = executor.imap_unordered(_fail, range(3))
+        self.assertRaises(ValueError, list, result)
+
+
+class TestRateLimit(TestCase):
+
+    KEY = "qarbon.test.rate_limit"
+
+    def tearDown(self):
+        executor.set_rate_limit(self.KEY, None)
+
+    def test_token_bucket(self):
+        bucket = executor.TokenBucket(10, burst=2)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.assertTrue(0 < bucket.delay() <= 0.1)
+        time.sleep(0.11)
+        self.assertTrue(bucket.consume())
+
+    def test_token_bucket_default_burst(self):
+        bucket = executor.TokenBucket(3)
+        self.assertEqual(bucket.burst, 3)
+        self.assertEqual(sum(bucket.consume() for _ in range(5)), 3)
+
+    def test_submit_limited_pacing(self):
+        executor.set_rate_limit(self.KEY, 20, burst=1)
+        start = time.time()
+        fs = [executor.submit_limited(self.KEY, time.time)
+              for _ in range(5)]
+        stamps = sorted(f.result(5) for f in fs)
+        # 1 call at once and the next 4 at 20 calls/s
+        self.assertTrue(stamps[-1] - start >= 0.15)
+        self.assertTrue(stamps[0] - start < 0.05)
+
+    def test_submit_limited_order(self):
+        executor.set_rate_limit(self.KEY, 50, burst=2)
+        result = []
+        fs = [executor.submit_limited(self.KEY, result.append, i)
+              for i in range(6)]
+        futures.wait(fs, timeout=5)
+        self.assertEqual(sorted(result), list(range(6)))
+        self.assertEqual(result[2:], [2, 3, 4, 5])
+
+    def test_submit_limited_errors(self):
+        executor.set_rate_limit(self.KEY, 50, burst=1)
+        fs = [executor.submit_limited(self.KEY, _fail, i) for i in range(3)]
+        for f in fs:
+            self.assertRaises(ValueError, f.result, 5)
+
+    def test_unlimited(self):
+        executor.set_rate_limit(self.KEY, None)
+        f = executor.submit_limited(self.KEY, _square, 4)
+        self.assertEqual(f.result(5), 16)
+
+
+class TestShutdown(TestCase):
+
+    def setUp(self):
+        self.event = threading.Event()
+
+    def tearDown(self):
+        self.event.set()
+
+    def test_in_flight(self):
+        f = executor.submit(_blocked, self.event)
+        self.assertTrue(any(call.startswith("_blocked(")
+                            for call in executor.in_flight()))
+        self.event.set()
+        f.result(5)
+        self.assertFalse(any(call.startswith("_blocked(")
+                             for call in executor.in_flight()))
+
+    def test_shutdown_timeout(self):
+        from qarbon import config
+        running = [executor.submit(_blocked, self.event)
+                   for _ in range(config.MAX_WORKERS)]
+        queued = [executor.submit(_square, i) for i in range(5)]
+        time.sleep(0.1)
+        start = time.time()
+        calls = executor.shutdown(timeout=0.2)
+        self.assertTrue(time.time() - start < 1.0)
+        # the running calls are reported, the queued ones cancelled
+        self.assertEqual(len(calls), config.MAX_WORKERS)
+        self.assertTrue(all(call.startswith("_blocked(") for call in calls))
+        self.assertTrue(all(f.cancelled() for f in queued))
+        self.assertFalse(any(f.done() for f in running))
+        # a new executor is created on demand
+        self.assertEqual(executor.submit(_square, 3).result(5), 9)
+
+    def test_exit_registration_failure(self):
+        # python raises RuntimeError when registering exit hooks during
+        # interpreter shutdown
+        def register_exit(fn):
+            raise RuntimeError("can't register atexit after shutdown")
+        register = executor._register_exit
+        registered = getattr(executor, "__EXIT_REGISTERED")
+        executor.shutdown()
+        executor._register_exit = register_exit
+        setattr(executor, "__EXIT_REGISTERED", False)
+        try:
+            self.assertEqual(executor.submit(_square, 2).result(5), 4)
+        finally:
+            executor._register_exit = register
+            setattr(executor, "__EXIT_REGISTERED", registered)
@@ -0,0 +1,109 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+import sys
+import datetime
+from unittest import TestCase
+
+import numpy
+
+from qarbon.core import AttributeValue, Quality
+from qarbon.history import History
+
+
+class TestHistory(TestCase):
+
+    def test_capacity(self):
+        self.assertRaises(ValueError, History, 0)
+        history = History(5)
+        self.assertEqual(history.capacity, 5)
+        self.assertEqual(history.shape, ())
+        self.assertEqual(len(history), 0)
+
+    def test_add(self):
+        history = History(5)
+        for i in range(3):
+            history.add(100.0 + i, i * 10.0)
+        times, magnitudes, qualities = history.last()
+        self.assertEqual(len(history), 3)
+        self.assertEqual(list(times), [100.0, 101.0, 102.0])
+        self.assertEqual(list(magnitudes), [0.0, 10.0, 20.0])
+        self.assertEqual(list(qualities), [0, 0, 0])
+
+    def test_wrap_around(self):
+        history = History(4)
+        for i in range(10):
+            history.add(float(i), float(i))
+        self.assertEqual(len(history), 4)
+        times, magnitudes, _ = history.last()
+        # oldest first and contiguous after wrapping
+        self.assertEqual(list(times), [6.0, 7.0, 8.0, 9.0])
+        self.assertEqual(list(magnitudes), [6.0, 7.0, 8.0, 9.0])
+        self.assertEqual(list(history.last(2)[0]), [8.0, 9.0])
+        self.assertEqual(list(history.last(10)[0]), [6.0, 7.0, 8.0, 9.0])
+
+    def test_views(self):
+        history = History(4)
+        for i in range(6):
+            history.add(float(i), float(i))
+        times = history.last()[0]
+        self.assertFalse(times.flags.owndata)
+
+    def test_window(self):
+        history = History(8)
+        for i in range(12):
+            history.add(float(i), float(i) * 2)
+        times, magnitudes, _ = history.window(6.0, 9.0)
+        self.assertEqual(list(times), [6.0, 7.0, 8.0])
+        self.assertEqual(list(magnitudes), [12.0, 14.0, 16.0])
+        self.assertEqual(list(history.window(stop=6.0)[0]), [4.0, 5.0])
+        self.assertEqual(list(history.window(start=10.5)[0]), [11.0])
+        self.assertEqual(len(history.window(100.0)[0]), 0)
+
+    def test_window_datetime(self):
+        history = History(4)
+        start = datetime.datetime(2013, 1, 1, 12, 0, 0)
+        for i in range(4):
+            history.add(start + datetime.timedelta(seconds=i), float(i))
+        window = history.window(start + datetime.timedelta(seconds=1),
+                                start + datetime.timedelta(seconds=3))
+        self.assertEqual(list(window[1]), [1.0, 2.0])
+
+    def test_spectrum(self):
+        history = History(3, shape=(4,), dtype=numpy.int32)
+        for i in range(5):
+            history.add(float(i), numpy.arange(4) + i)
+        _, magnitudes, _ = history.last()
+        self.assertEqual(magnitudes.shape, (3, 4))
+        self.assertEqual(magnitudes.dtype, numpy.int32)
+        self.assertEqual(list(magnitudes[0]), [2, 3, 4, 5])
+
+    def test_append(self):
+        history = History(4)
+        now = datetime.datetime.now()
+        history.append(AttributeValue(r_value=1.5, r_timestamp=now,
+                                      r_quality=Quality.Warning))
+        try:
+            raise ValueError("read failed")
+        except ValueError:
+            history.append(AttributeValue(r_timestamp=now,
+                                          exc_info=sys.exc_info()))
+        _, magnitudes, qualities = history.last()
+        self.assertEqual(magnitudes[0], 1.5)
+        self.assertTrue(numpy.isnan(magnitudes[1]))
+        self.assertEqual(list(qualities), [Quality.Warning.value,
+                                           Quality.Invalid.value])
+
+    def test_clear(self):
+        history = History(4)
+        history.add(1.0, 1.0)
+        history.clear()
+        self.assertEqual(len(history), 0)
+        self.assertEqual(len(history.last()[0]), 0)
@@ -0,0 +1,156 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import shutil
+import datetime
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from qarbon.core import AttributeConfig, AttributeValue, Quality
+from qarbon.external.pint import Quantity
+from qarbon.recorder import Recorder, Recording, ReplayFactory
+from qarbon.recorder import VALUE, CONFIG, ERROR
+from qarbon.simulation import Factory as SimulationFactory
+
+
+def _config(name, unit=None, ndim=0):
+    attr_cfg = AttributeConfig()
+    attr_cfg.name = attr_cfg.label = name
+    attr_cfg.ndim = ndim
+    if unit is not None:
+        attr_cfg.unit = Quantity(1, units=unit).units
+    return attr_cfg
+
+
+def _timestamp(t):
+    return datetime.datetime.fromtimestamp(t)
+
+
+class TestRecorder(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def __record(self):
+        """records 3 scalars, an error and a spectrum. Returns the start
+        time"""
+        scalar_cfg = _config("position", unit="mm")
+        spectrum_cfg = _config("spectrum", ndim=1)
+        t0 = time.time()
+        recorder = Recorder(self.path, flush_size=2)
+        for i in range(3):
+            recorder.record("sim/motor/1/position", AttributeValue(
+                r_value=Quantity(float(i), "mm"), config=scalar_cfg,
+                r_timestamp=_timestamp(t0 + i * 0.01)))
+        try:
+            raise ValueError("read failed")
+        except ValueError:
+            recorder.record("sim/motor/1/position", AttributeValue(
+                r_timestamp=_timestamp(t0 + 0.03), config=scalar_cfg,
+                exc_info=sys.exc_info()))
+        recorder.record("sim/detector/1/spectrum", AttributeValue(
+            r_value=numpy.arange(5.0), config=spectrum_cfg,
+            r_quality=Quality.Warning, r_timestamp=_timestamp(t0 + 0.04)))
+        recorder.close()
+        return t0
+
+    def test_recording(self):
+        t0 = self.__record()
+        recording = Recording(self.path)
+        self.assertEqual(recording.names, ["sim/motor/1/position",
+                                           "sim/detector/1/spectrum"])
+        # each attribute config is recorded before its first value
+        self.assertEqual(list(recording.kind), [CONFIG, VALUE, VALUE, VALUE,
+                                                ERROR, CONFIG, VALUE])
+        self.assertEqual(len(recording), 7)
+        self.assertTrue(abs(recording.time[0] - t0) < 1E-3)
+        self.assertEqual(recording.magnitude(2), 1.0)
+        self.assertEqual(list(recording.magnitude(6)), list(range(5)))
+        attr_cfg = recording.attribute_config(0)
+        self.assertEqual(attr_cfg.name, "position")
+        self.assertEqual(str(attr_cfg.unit), "millimeter")
+        value = recording.value(3, attr_cfg)
+        self.assertEqual(value.r_value, Quantity(2.0, "mm"))
+        self.assertTrue(recording.value(4, attr_cfg).error)
+        value = recording.value(6, recording.attribute_config(5))
+        self.assertEqual(value.r_quality, Quality.Warning)
+        self.assertEqual(value.r_ndim, 1)
+
+    def test_append(self):
+        self.__record()
+        recorder = Recorder(self.path)
+        recorder.record("sim/motor/1/position", AttributeValue(
+            r_value=Quantity(7.0, "mm"), config=_config("position", "mm"),
+            r_timestamp=_timestamp(time.time())))
+        recorder.close()
+        recording = Recording(self.path)
+        self.assertEqual(len(recording.names), 2)
+        self.assertEqual(recording.magnitude(len(recording) - 1), 7.0)
+
+    def test_replay(self):
+        self.__record()
+        replay = ReplayFactory(self.path, speed=0)
+        position = replay.get_attribute("sim/motor/1/position")
+        spectrum = replay.get_attribute("sim/detector/1/spectrum")
+        values = []
+        position.valueChanged.connect(
+            lambda: values.append(position.get_value().result()))
+        finished = []
+        replay.finished.connect(lambda: finished.append(True))
+        replay.start()
+        replay.join(5)
+        self.assertEqual(finished, [True])
+        # config records notify as well
+        self.assertEqual(len(values), 5)
+        magnitudes = [value.r_magnitude for value in values[1:4]]
+        self.assertEqual(magnitudes, [0.0, 1.0, 2.0])
+        self.assertEqual(str(values[1].r_value.units), "millimeter")
+        self.assertTrue(values[4].error)
+        last = spectrum.get_value().result()
+        self.assertEqual(list(last.r_magnitude), list(range(5)))
+        self.assertEqual(position.device.get_attribute_config(
+            "position").result().name, "position")
+        # read only: writes and commands fail
+        self.assertRaises(NotImplementedError, position.write(1.0).result)
+        self.assertRaises(NotImplementedError,
+                          position.device.run_command("Init").result)
+
+    def test_record_attribute(self):
+        factory = SimulationFactory(rate=100)
+        attribute = factory.get_attribute("sim/dev/1/value")
+        recorder = Recorder(self.path)
+        recorder.add(attribute)
+        time.sleep(0.2)
+        recorder.remove(attribute)
+        recorder.close()
+        recording = Recording(self.path)
+        self.assertEqual(recording.names, ["sim/dev/1/value"])
+        self.assertTrue(list(recording.kind).count(VALUE) > 5)
+
+    def test_configs_written_on_flush(self):
+        recorder = Recorder(self.path)
+        for i in range(3):
+            recorder.record_config("sim/dev/1/value", _config("value"))
+        meta_filename = os.path.join(self.path, "attributes.json")
+        self.assertFalse(os.path.exists(meta_filename))
+        recorder.flush()
+        self.assertTrue(os.path.exists(meta_filename))
+        recorder.close()
+        recording = Recording(self.path)
+        self.assertEqual(list(recording.kind), [CONFIG] * 3)
+        self.assertEqual(recording.attribute_config(2).name, "value")
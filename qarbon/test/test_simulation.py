@@ -0,0 +1,39 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+from unittest import TestCase
+
+from qarbon.external.pint import Quantity
+from qarbon.simulation import Factory
+
+
+class TestWrite(TestCase):
+
+    def setUp(self):
+        self.factory = Factory()
+        self.factory.add_attribute("sim/motor/1/position", unit="mm",
+                                   writable=True)
+        self.factory.add_attribute("sim/detector/1/roi", ndim=1,
+                                   writable=True)
+
+    def test_write(self):
+        position = self.factory.get_attribute("sim/motor/1/position")
+        self.assertEqual(position.write(Quantity(2, "m")).result(), None)
+        self.assertEqual(position.read().result(5).w_value,
+                         Quantity(2000, "mm"))
+
+    def test_write_spectrum(self):
+        roi = self.factory.get_attribute("sim/detector/1/roi")
+        roi.write([10, 20]).result()
+        self.assertEqual(roi.read().result(5).w_magnitude, [10, 20])
+
+    def test_read_only(self):
+        temperature = self.factory.get_attribute("sim/motor/1/temperature")
+        self.assertRaises(ValueError, temperature.write(1.0).result)
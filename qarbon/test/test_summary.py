@@ -0,0 +1,125 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+import time
+import datetime
+from unittest import TestCase
+
+from concurrent import futures
+
+from qarbon.core import Signal, State, AttributeValue
+from qarbon.summary import StateSummary, state_from_value
+
+
+class _Device(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _StateAttribute(object):
+    """state attribute stand-in"""
+
+    valueChanged = Signal()
+
+    def __init__(self, dev_name, state):
+        self.device = _Device(dev_name)
+        self.set_state(state, notify=False)
+
+    def set_state(self, state, notify=True):
+        self.value = AttributeValue(r_value=state.value,
+                                    r_timestamp=datetime.datetime.now())
+        if notify:
+            self.valueChanged.emit()
+
+    def get_value(self):
+        future = futures.Future()
+        future.set_result(self.value)
+        return future
+
+
+class TestStateSummary(TestCase):
+
+    def test_state_from_value(self):
+        self.assertEqual(state_from_value(None), State.Unknown)
+        attr_value = AttributeValue(r_value=State.Fault.value)
+        self.assertEqual(state_from_value(attr_value), State.Fault)
+
+    def test_counts(self):
+        summary = StateSummary(max_rate=0)
+        for i in range(4):
+            summary.add("dev/{0}".format(i), ("all", "odd" if i % 2 else
+                                              "even"), State.On)
+        self.assertEqual(sorted(summary.groups()), ["all", "even", "odd"])
+        self.assertEqual(summary.get_counts("all"), {State.On: 4})
+        summary.update("dev/1", State.Alarm)
+        summary.update("dev/2", State.Moving)
+        self.assertEqual(summary.get_counts("all"),
+                         {State.On: 2, State.Alarm: 1, State.Moving: 1})
+        self.assertEqual(summary.get_counts("odd"),
+                         {State.On: 1, State.Alarm: 1})
+        self.assertEqual(summary.get_state("dev/2"), State.Moving)
+        self.assertEqual(summary.get_summary("even"),
+                         (2, {State.On: 1, State.Moving: 1}, State.Moving))
+
+    def test_worst(self):
+        summary = StateSummary(max_rate=0)
+        summary.add("a", ("all",), State.On)
+        summary.add("b", ("all",), State.Standby)
+        self.assertEqual(summary.get_worst("all"), State.Standby)
+        summary.update("a", State.Fault)
+        summary.update("b", State.Alarm)
+        self.assertEqual(summary.get_worst("all"), State.Fault)
+        summary.update("a", State.On)
+        self.assertEqual(summary.get_worst("all"), State.Alarm)
+        summary.remove("b")
+        self.assertEqual(summary.get_worst("all"), State.On)
+        summary.remove("a")
+        self.assertEqual(summary.get_worst("all"), None)
+        self.assertEqual(summary.get_summary("all"), (0, {}, None))
+
+    def test_publish(self):
+        summary = StateSummary(max_rate=0)
+        changed = []
+        summary.summaryChanged.connect(changed.append)
+        summary.add("a", ("g1", "g2"))
+        self.assertEqual(sorted(changed), ["g1", "g2"])
+        del changed[:]
+        summary.update("a", State.Unknown)
+        # no change: nothing published
+        self.assertEqual(changed, [])
+
+    def test_throttle(self):
+        summary = StateSummary(max_rate=10)
+        changed = []
+        summary.summaryChanged.connect(changed.append)
+        summary.add("a", ("all",), State.On)
+        self.assertEqual(changed, ["all"])
+        for state in (State.Alarm, State.Fault, State.On, State.Moving):
+            summary.update("a", state)
+        # the changes are published once, after the throttling period
+        self.assertEqual(changed, ["all"])
+        time.sleep(0.3)
+        self.assertEqual(changed, ["all", "all"])
+        self.assertEqual(summary.get_worst("all"), State.Moving)
+
+    def test_watch(self):
+        summary = StateSummary(max_rate=0)
+        attributes = [_StateAttribute("dev/{0}".format(i), State.On)
+                      for i in range(3)]
+        for attribute in attributes:
+            summary.watch(attribute, groups=("all",))
+        self.assertEqual(summary.get_counts("all"), {State.On: 3})
+        attributes[0].set_state(State.Fault)
+        self.assertEqual(summary.get_worst("all"), State.Fault)
+        summary.unwatch("dev/0")
+        self.assertEqual(summary.get_summary("all")[0], 2)
+        attributes[0].set_state(State.Alarm)
+        self.assertEqual(summary.get_worst("all"), State.On)
@@ -0,0 +1,336 @@
+# ----------------------------------------------------------------------------
+# This file is part of qarbon (http://qarbon.rtfd.org/)
+#
+# Copyright (c) 2013 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Distributed under the terms of the GNU Lesser General Public License,
+# either version 3 of the License, or (at your option) any later version.
+# See LICENSE.txt for more info.
+# ----------------------------------------------------------------------------
+
+"""Tests of the tango plugin against simulated devices
+(:class:`qarbon.simulation.TangoSimulator`)"""
+
+import sys
+import time
+from unittest import TestCase, skipIf
+
+from concurrent import futures
+
+try:
+    import PyTango
+except ImportError:
+    PyTango = None
+
+from qarbon import config
+from qarbon.external.pint import Quantity
+from qarbon.executor import submit
+
+if PyTango is not None:
+    from qarbon import tango
+    from qarbon.simulation import TangoSimulator, DeviceProxy
+
+    class _NoConfigProxy(DeviceProxy):
+        """simulated device failing to give its attribute configs (until
+        fixed) and emitting no config events"""
+
+        def __init__(self, name, simulator):
+            DeviceProxy.__init__(self, name, simulator)
+            self.fixed = False
+            self.config_calls = 0
+
+        def get_attribute_config_ex(self, attr_names):
+            self.config_calls += 1
+            if not self.fixed:
+                PyTango.Except.throw_exception("Broken", "no config",
+                                               "get_attribute_config_ex")
+            return DeviceProxy.get_attribute_config_ex(self, attr_names)
+
+        def subscribe_event(self, attr_name, event_type, callback, *args,
+                            **kwargs):
+            if event_type == PyTango.EventType.ATTR_CONF_EVENT:
+                callback = lambda event_data: None
+            return DeviceProxy.subscribe_event(self, attr_name, event_type,
+                                               callback, *args, **kwargs)
+
+
+@skipIf(PyTango is None, "PyTango not available")
+class TangoTestCase(TestCase):
+    """Installs a TangoSimulator (self.simulator) and creates a tango
+    Factory (self.factory)"""
+
+    def setUp(self):
+        self.simulator = TangoSimulator()
+        self.simulator.install()
+        tango.db_cache().clear()
+        self.factory = tango.Factory()
+
+    def tearDown(self):
+        self.simulator.uninstall()
+        tango.db_cache().clear()
+
+
+class TestExpand(TangoTestCase):
+
+    def setUp(self):
+        TangoTestCase.setUp(self)
+        for name in ("Current", "Voltage", "State"):
+            self.simulator.add_attribute("sim/ps/1/" + name)
+        self.expand_timeout = config.TANGO_EXPAND_TIMEOUT
+
+    def tearDown(self):
+        config.TANGO_EXPAND_TIMEOUT = self.expand_timeout
+        TangoTestCase.tearDown(self)
+
+    def test_no_pattern(self):
+        self.assertEqual(self.factory.expand("sim/ps/1/current"),
+                         ["sim/ps/1/current"])
+
+    def test_attribute_pattern(self):
+        self.assertEqual(sorted(self.factory.expand("sim/ps/1/*")),
+                         ["sim/ps/1/Current", "sim/ps/1/State",
+                          "sim/ps/1/Voltage"])
+        self.assertEqual(self.factory.expand("sim/ps/1/CUR*"),
+                         ["sim/ps/1/Current"])
+        self.assertEqual(self.factory.expand("sim/ps/1/?o*"),
+                         ["sim/ps/1/Voltage"])
+        self.assertEqual(self.factory.expand("sim/ps/1/[v]olt*"),
+                         ["sim/ps/1/Voltage"])
+
+    def test_get_attributes(self):
+        attributes = self.factory.get_attributes("sim/ps/1/c*")
+        self.assertEqual([attribute.name for attribute in attributes],
+                         ["Current"])
+
+    def test_cached(self):
+        self.factory.expand("sim/ps/1/*")
+        self.simulator.add_attribute("sim/ps/1/Power")
+        self.assertEqual(self.factory.expand("sim/ps/1/p*"), [])
+        tango.db_cache().clear()
+        self.assertEqual(self.factory.expand("sim/ps/1/p*"),
+                         ["sim/ps/1/Power"])
+
+    def test_timeout(self):
+        config.TANGO_EXPAND_TIMEOUT = 0.1
+
+        def slow_proxy(name):
+            time.sleep(0.5)
+            return self.simulator.device_proxy(name)
+        tango.proxy_pool().set_proxy_factory(slow_proxy)
+        start = time.time()
+        self.assertEqual(self.factory.expand("sim/ps/1/*"), [])
+        self.assertTrue(time.time() - start < 0.4)
+
+
+class TestRead(TangoTestCase):
+
+    def setUp(self):
+        TangoTestCase.setUp(self)
+        self.io_mode = config.TANGO_IO_MODE
+        self.simulator.add_attribute("sim/motor/1/position", unit="mm")
+        self.simulator.add_attribute("sim/motor/1/broken", fault_rate=1.0)
+        self.device = self.factory.get_device("sim/motor/1")
+
+    def tearDown(self):
+        config.TANGO_IO_MODE = self.io_mode
+        TangoTestCase.tearDown(self)
+
+    def __check_batch(self, attr_values):
+        position = attr_values["position"].result(5)
+        self.assertFalse(position.error)
+        self.assertEqual(str(position.r_value.units), "millimeter")
+        self.assertRaises(PyTango.DevFailed, attr_values["broken"].result, 5)
+
+    def test_read_attribute(self):
+        position = self.device.read_attribute("position").result(5)
+        self.assertFalse(position.error)
+        broken = self.device.read_attribute("broken")
+        self.assertRaises(PyTango.DevFailed, broken.result, 5)
+
+    def test_read_attributes(self):
+        self.__check_batch(self.device.read_attributes(["position",
+                                                        "broken"]))
+
+    def test_read_attributes_asynch(self):
+        config.TANGO_IO_MODE = "asynch"
+        self.__check_batch(self.device.read_attributes(["position",
+                                                        "broken"]))
+
+    def test_factory_read_attributes(self):
+        attr_values = self.factory.read_attributes(["sim/motor/1/position",
+                                                    "sim/motor/1/broken",
+                                                    "sim/motor/2/value"])
+        self.__check_batch(dict((name.rsplit("/", 1)[1], attr_value)
+                                for name, attr_value in attr_values.items()))
+        self.assertFalse(attr_values["sim/motor/2/value"].result(5).error)
+
+    def test_factory_read_no_waiting_worker(self):
+        # replies are pushed: the workers are free while they are awaited
+        names = ["sim/slow/{0}/value".format(i)
+                 for i in range(2 * config.MAX_WORKERS)]
+        for name in names:
+            self.simulator.add_attribute(name, latency=0.5)
+        for attr_value in self.factory.read_attributes(names).values():
+            attr_value.result(5)
+        attr_values = self.factory.read_attributes(names)
+        time.sleep(0.1)
+        start = time.time()
+        self.assertEqual(submit(int, 1).result(5), 1)
+        self.assertTrue(time.time() - start < 0.2)
+        for attr_value in attr_values.values():
+            self.assertFalse(attr_value.result(5).error)
+
+
+class TestWrite(TangoTestCase):
+
+    def setUp(self):
+        TangoTestCase.setUp(self)
+        self.io_mode = config.TANGO_IO_MODE
+        self.simulator.add_attribute("sim/motor/1/position", unit="mm",
+                                     writable=True)
+        self.simulator.add_attribute("sim/motor/1/velocity", writable=True)
+        self.simulator.add_attribute("sim/motor/1/temperature")
+        self.device = self.factory.get_device("sim/motor/1")
+
+    def tearDown(self):
+        config.TANGO_IO_MODE = self.io_mode
+        TangoTestCase.tearDown(self)
+
+    def __check_write(self):
+        attribute = self.factory.get_attribute("sim/motor/1/position")
+        self.assertEqual(attribute.write(Quantity(2, "m")).result(5), None)
+        w_value = attribute.read().result(5).w_value
+        self.assertEqual(w_value, Quantity(2000, "mm"))
+        # writes are merged into one round trip
+        writes = [self.device.write_attribute("velocity", 1.0),
+                  self.device.write_attribute("position", 1.0)]
+        for write in writes:
+            self.assertEqual(write.result(5), None)
+        read_only = self.device.write_attribute("temperature", 1.0)
+        self.assertRaises(PyTango.DevFailed, read_only.result, 5)
+
+    def test_write(self):
+        self.__check_write()
+
+    def test_write_asynch(self):
+        config.TANGO_IO_MODE = "asynch"
+        self.__check_write()
+
+    def test_cancelled_write(self):
+        def cancelled_submit(fn, *args, **kwargs):
+            future = futures.Future()
+            future.cancel()
+            return future
+        self.device._submit = cancelled_submit
+        write = self.device.write_attribute("position", 1.0)
+        self.assertRaises(futures.CancelledError, write.result, 5)
+        # the next writes are sent
+        del self.device._submit
+        self.assertEqual(self.device.write_attribute("position",
+                                                     2.0).result(5), None)
+
+
+class TestCommand(TangoTestCase):
+
+    def setUp(self):
+        TangoTestCase.setUp(self)
+        self.io_mode = config.TANGO_IO_MODE
+        self.device = self.factory.get_device("sim/motor/1")
+
+    def tearDown(self):
+        config.TANGO_IO_MODE = self.io_mode
+        TangoTestCase.tearDown(self)
+
+    def __check_commands(self):
+        self.assertEqual(self.device.run_command("Echo", 5).result(5), 5)
+        self.assertEqual(self.device.get_state().result(5),
+                         PyTango.DevState.ON)
+
+    def test_run_command(self):
+        self.__check_commands()
+
+    def test_run_command_asynch(self):
+        config.TANGO_IO_MODE = "asynch"
+        self.__check_commands()
+        self.assertRaises(TypeError, self.device.run_command, "Echo", 5,
+                          green_mode=None)
+
+
+class TestConfig(TangoTestCase):
+
+    def setUp(self):
+        TangoTestCase.setUp(self)
+        self.simulator.add_attribute("sim/ps/1/current", unit="A")
+        self.simulator.add_attribute("sim/ps/1/voltage", unit="V")
+        self.device = self.factory.get_device("sim/ps/1")
+
+    def test_get_attribute_config(self):
+        attr_cfg = self.device.get_attribute_config("Current").result(5)
+        self.assertEqual(attr_cfg.unit, Quantity(1, "A"))
+        # cached
+        self.assertTrue(self.device.get_attribute_config("current").done())
+
+    def test_prefetch(self):
+        attr_cfgs = self.device.prefetch_attribute_configs(
+            ["Current"]).result(5)
+        self.assertEqual(list(attr_cfgs), ["current"])
+        attr_cfgs = self.device.prefetch_attribute_configs().result(5)
+        self.assertEqual(sorted(attr_cfgs), ["current", "voltage"])
+        self.assertEqual(attr_cfgs["voltage"].unit, Quantity(1, "V"))
+        self.assertTrue(self.device.get_attribute_config("voltage").done())
+
+
+class TestEvents(TangoTestCase):
+
+    def setUp(self):
+        TangoTestCase.setUp(self)
+        self.simulator.add_attribute("sim/motor/1/position", rate=50)
+
+    def test_change_events(self):
+        attribute = self.factory.get_attribute("sim/motor/1/position")
+        values = []
+        attribute.valueChanged.connect(
+            lambda: values.append(attribute.get_value().result(5)))
+        time.sleep(0.3)
+        self.assertTrue(len(values) > 5, len(values))
+        for value in values:
+            self.assertFalse(value.error)
+
+    def test_throttled_slot_reads(self):
+        attribute = self.factory.get_attribute("sim/motor/1/position")
+        attribute.get_value().result(5)
+        attribute.set_event_policy(max_rate=5)
+        results = []
+
+        def on_change():
+            # slots may wait for reads, also for trailing notifications
+            try:
+                results.append(attribute.read().result(2))
+            except Exception:
+                results.append(sys.exc_info()[1])
+        attribute.valueChanged.connect(on_change)
+        time.sleep(1.0)
+        attribute.valueChanged.disconnect(on_change)
+        self.assertTrue(2 <= len(results) <= 8)
+        for result in results:
+            self.assertFalse(isinstance(result, Exception), result)
+
+    def test_events_without_config(self):
+        proxies = []
+
+        def proxy_factory(name):
+            proxies.append(_NoConfigProxy(name, self.simulator))
+            return proxies[-1]
+        tango.proxy_pool().set_proxy_factory(proxy_factory)
+        attribute = self.factory.get_attribute("sim/motor/1/position")
+        values = []
+        attribute.valueChanged.connect(lambda: values.append(True))
+        time.sleep(0.5)
+        # the events are dropped and the config is only fetched again by
+        # the next event (not in a loop)
+        self.assertEqual(values, [])
+        self.assertTrue(proxies[0].config_calls < 40, proxies[0].config_calls)
+        proxies[0].fixed = True
+        time.sleep(0.2)
+        self.assertTrue(values)
+        self.assertFalse(attribute.get_value().result(5).error)